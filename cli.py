@@ -13,6 +13,15 @@ import argparse
 from main import RestoreFiles, CheckUpdates, ModuleData, Main, Settings
 from main import VERSION_CURRENT, SEPARATOR
 
+# Type of the --precision-* arguments,
+# rejects them before any output gets written
+def Precision(value):
+    precision = int(value)
+    if precision < 1:
+        raise argparse.ArgumentTypeError(f'has to be at least 1, found {precision}')
+    return precision
+
+
 # Class for disabling the output log
 # strictly for --silent option
 # Source: https://stackoverflow.com/questions/8391411/how-to-block-calls-to-print
@@ -118,6 +127,40 @@ def CliMenu():
                         help='Strip armature tree data.\n'
                              'Necessary for reimporting armors '
                              'utilizing the pc model armature.')
+    parser.add_argument('--geometry-jobs', type=int, default=1, metavar='N',
+                        help='Number of processes extracting geometries\n'
+                             'of a single multi-geometry file (Collada)')
+    parser.add_argument('--stream-collada', action='store_true',
+                        help='Read Collada files incrementally, keeping\n'
+                             'the memory usage flat on large files')
+    parser.add_argument('--crease-angle', type=float, default=None, metavar='DEG',
+                        help='Keep hard edges between faces meeting at a sharper\n'
+                             'angle when generating missing normals (Collada)')
+    parser.add_argument('--precision-positions', type=Precision, default=None, metavar='N',
+                        help='Significant digits of exported vertex positions')
+    parser.add_argument('--precision-normals', type=Precision, default=None, metavar='N',
+                        help='Significant digits of exported normals')
+    parser.add_argument('--precision-texcoords', type=Precision, default=None, metavar='N',
+                        help='Significant digits of exported texture coordinates')
+    parser.add_argument('--precision-weights', type=Precision, default=None, metavar='N',
+                        help='Significant digits of exported bone weights')
+    parser.add_argument('--compact', action='store_true',
+                        help='Separate exported values with "," instead of ", "')
+    parser.add_argument('-o', '--output-dir', default=None, metavar='DIR',
+                        help='Write output files to this directory\n'
+                             'instead of next to the input files')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='Overwrite existing output files instead\n'
+                             'of writing to new "name(n).xml" files')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='Number of processes converting files,\n'
+                             'a failed file does not stop the others')
+    parser.add_argument('--memory-budget', type=int, default=None, metavar='MB',
+                        help='Peak memory budget, garbage is collected near it\n'
+                             'and lower memory code paths are used under pressure')
+    parser.add_argument('--pipeline', type=int, default=0, metavar='DEPTH',
+                        help='Read up to DEPTH files ahead and write up to\n'
+                             'DEPTH outputs behind the extraction')
 
     parser_args = parser.parse_args()
 
@@ -141,7 +184,19 @@ def CliMenu():
             print(SEPARATOR)
 
         settings = Settings(file_names=parser_args.files_list, model_mode=parser_args.mode,
-                            no_export_file=parser_args.no_file, strip_armature_tree=parser_args.strip_armature_tree)
+                            no_export_file=parser_args.no_file, strip_armature_tree=parser_args.strip_armature_tree,
+                            geometry_jobs=parser_args.geometry_jobs, stream_collada=parser_args.stream_collada,
+                            crease_angle=parser_args.crease_angle,
+                            precision_positions=parser_args.precision_positions,
+                            precision_normals=parser_args.precision_normals,
+                            precision_texcoords=parser_args.precision_texcoords,
+                            precision_weights=parser_args.precision_weights,
+                            compact_output=parser_args.compact,
+                            output_dir=parser_args.output_dir,
+                            overwrite_output=parser_args.overwrite,
+                            pipeline_depth=parser_args.pipeline,
+                            jobs=parser_args.jobs,
+                            memory_budget=parser_args.memory_budget)
         geometry = Main(settings)
 
     if parser_args.no_file:
@@ -5,8 +5,11 @@
 ###############################################################
 
 import logging
+import logging.handlers
 import os
 import platform
+import contextlib
+import multiprocessing
 from components.check_updates import VERSION_CURRENT
 
 
@@ -68,3 +71,34 @@ def EndLogging():
     logger = logging.getLogger(LOGGING_APP)
     logger.info('Finished logging to "%s"', LOGGING_FILE)
     logger.info(SEPARATOR)
+
+
+@contextlib.contextmanager
+def WorkerLogging():
+    '''
+    Yields a queue for worker processes to log to, the records
+    are handled by the handlers of this process until the exit.
+    Worker processes pass it to InitWorkerLogging().
+    The queue is kept by a manager process, a worker killed while
+    logging cannot leave it locked like a multiprocessing.Queue.
+    '''
+    logger = logging.getLogger(LOGGING_APP)
+    with multiprocessing.Manager() as manager:
+        log_queue = manager.Queue()
+        log_listener = logging.handlers.QueueListener(log_queue, *logger.handlers,
+                                                      respect_handler_level=True)
+        log_listener.start()
+        try:
+            yield log_queue
+        finally:
+            log_listener.stop()
+
+
+def InitWorkerLogging(log_queue):
+    '''
+    Sends the logs of a worker process to the queue of WorkerLogging().
+    '''
+    logger = logging.getLogger(LOGGING_APP)
+    logger.handlers.clear()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG)
@@ -0,0 +1,179 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import gc
+import os
+import sys
+import contextlib
+
+from components.logger import GetLogger
+logger = GetLogger()
+
+# Fraction of the budget at which garbage gets collected
+COLLECT_THRESHOLD = 0.8
+
+# Fraction of the budget the memory has to grow by
+# since the last collection to be collected again
+COLLECT_MARGIN = 0.1
+
+MEGABYTE = 1 << 20
+
+
+# Returns the current resident set size of the process in bytes
+def CurrentRSS():
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                        ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        get_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(PROCESS_MEMORY_COUNTERS), wintypes.DWORD]
+        get_memory_info(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb)
+        return counters.WorkingSetSize
+
+    # No portable way to read the current size, the peak one
+    # only overestimates it. Reported in bytes on macOS.
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryGovernor:
+    '''
+    Keeps the resident memory of the process within a budget.
+    - self.budget: Peak RSS budget in bytes, None disables the governor.
+    - self.peak: Highest RSS sampled since the last self.reset_peak().
+
+    Instead of collecting garbage after every step, self.checkpoint()
+    collects only once the RSS approaches the budget. Code paths able to
+    trade speed for memory ask self.fits() whether their estimated
+    memory use fits within what is left of the budget.
+    '''
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.peak = 0
+        self._collect_rss = 0
+        self._warned = False
+
+    def sample(self):
+        '''
+        Returns the current RSS, updating the peak.
+        '''
+        rss = CurrentRSS()
+        self.peak = max(self.peak, rss)
+        return rss
+
+    def reset_peak(self):
+        self.peak = 0
+
+    def reset(self, budget):
+        '''
+        Sets a new budget, forgetting the state tracked for the old one.
+        '''
+        self.budget = budget
+        self.peak = 0
+        self._collect_rss = 0
+        self._warned = False
+
+    def checkpoint(self):
+        '''
+        Collects garbage if the RSS approaches the budget.
+        '''
+        if self.budget is None:
+            return
+        rss = self.sample()
+        if rss < max(self.budget * COLLECT_THRESHOLD, self._collect_rss):
+            return
+
+        gc.collect()
+        collected_rss = CurrentRSS()
+        logger.debug('Memory budget approached, collected %.1f MB.', (rss - collected_rss) / MEGABYTE)
+
+        # Memory that survived the collection is in use, collecting
+        # again makes sense only once more of it gets allocated
+        self._collect_rss = collected_rss + self.budget * COLLECT_MARGIN
+        if collected_rss > self.budget and not self._warned:
+            logger.warning('Memory use of %.0f MB exceeds the budget of %.0f MB.',
+                           collected_rss / MEGABYTE, self.budget / MEGABYTE)
+            self._warned = True
+
+    def fits(self, estimate):
+        '''
+        Returns True if estimate more bytes fit within the budget.
+        '''
+        if self.budget is None:
+            return True
+        return self.sample() + estimate <= self.budget
+
+    def allowed_jobs(self, jobs, estimate):
+        '''
+        Returns how many of jobs using estimate bytes each fit within the budget, at least 1.
+        '''
+        if self.budget is None or estimate <= 0:
+            return jobs
+        return max(1, min(jobs, int((self.budget - self.sample()) // estimate)))
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''
+        Tracks the memory allocated by a stage of the conversion,
+        ending it with a checkpoint.
+        '''
+        if self.budget is None:
+            yield
+            return
+        rss = self.sample()
+        try:
+            yield
+        finally:
+            stage_rss = self.sample()
+            logger.debug('Stage "%s": %+.1f MB, RSS %.1f MB.', name,
+                         (stage_rss - rss) / MEGABYTE, stage_rss / MEGABYTE)
+            self.checkpoint()
+
+
+_governor = MemoryGovernor()
+
+
+def GetMemoryGovernor():
+    '''
+    Returns the memory governor of the process.
+    '''
+    return _governor
+
+
+def SetMemoryBudget(budget):
+    '''
+    Sets the peak RSS budget of the process memory governor, in bytes.
+    '''
+    _governor.reset(budget)
+
+
+def WorkerMemoryBudget(jobs):
+    '''
+    Splits what is left of the memory budget of the process
+    between jobs worker processes, None if there is no budget.
+    '''
+    if _governor.budget is None:
+        return None
+    return max(_governor.budget - _governor.sample(), 0) // jobs
@@ -0,0 +1,67 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+'''
+Mesh helpers shared by the modules
+'''
+
+import math
+import numpy as np
+
+
+def DeduplicateCorners(corners):
+    """
+    Merges face corners pointing at the same attributes into single vertices,
+    keeping the order of their first appearance.
+
+    Args:
+        corners (numpy.ndarray): (N, C) array of attribute indices of every face corner, i.e. v/vt/vn.
+
+    Returns:
+        tuple: (M, C) array of unique face corners and index of the unique corner for every input corner.
+    """
+
+    # Pack the rows into single integer keys if they fit,
+    # sorting a flat array is a lot faster than sorting rows
+    keys = None
+    if corners.size and corners.min() >= 0:
+        bounds = [int(bound) + 1 for bound in corners.max(axis=0)]
+        if math.prod(bounds) < np.iinfo(np.int64).max:
+            keys = corners[:, 0].astype(np.int64)
+            for column, bound in enumerate(bounds[1:], start=1):
+                keys = keys * bound + corners[:, column]
+
+    if keys is not None:
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    else:
+        _, first, inverse = np.unique(corners, axis=0, return_index=True, return_inverse=True)
+
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return corners[first[order]], rank[inverse.ravel()]
+
+
+def TriangulatePolygons(vcounts):
+    """
+    Fan triangulates polygons made of consecutive runs of corners.
+    Polygons with less than 3 corners are dropped.
+
+    Args:
+        vcounts (numpy.ndarray): Number of corners of every polygon.
+
+    Returns:
+        numpy.ndarray: (T, 3) array of corner positions of every triangle.
+    """
+    vcounts = np.asarray(vcounts, dtype=np.intp)
+    starts = np.cumsum(vcounts) - vcounts
+    triangles_num = np.maximum(vcounts - 2, 0)
+
+    # Every triangle of a polygon shares its first corner,
+    # the other two move along the polygon edges
+    fan_starts = np.repeat(starts, triangles_num)
+    steps = np.arange(triangles_num.sum()) - np.repeat(np.cumsum(triangles_num) - triangles_num, triangles_num)
+    return np.stack([fan_starts, fan_starts + steps + 1, fan_starts + steps + 2], axis=1)
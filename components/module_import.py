@@ -4,6 +4,8 @@
 # Github: https://github.com/Crowfunder                       #
 ###############################################################
 
+import inspect
+
 import modules
 from components.logger import SEPARATOR
 
@@ -47,6 +49,7 @@ def ProcessModules(file_name):
 
     Returns:
         tuple: A tuple containing the extract function and module data.
+               The function takes the file name and the run settings.
 
     Raises:
         Exception: If the file type is unrecognized.
@@ -58,6 +61,54 @@ def ProcessModules(file_name):
     # Refer to "modules/__init__.py" for relevant code
     if file_extension in modules.__modules__.keys():
         extract_module = modules.__modules__[file_extension]
-        return extract_module.Extract, extract_module.module_data
+        return WithSettings(extract_module.Extract), extract_module.module_data
     else:
         raise Exception('Unrecognized file type!')
+
+
+def WithSettings(function):
+    """
+    Wraps a module extract function to take the run settings.
+    Modules are only required to provide Extract(file_name),
+    the settings are passed to the functions that accept them.
+    """
+    try:
+        parameters = inspect.signature(function).parameters.values()
+    except (TypeError, ValueError):
+        parameters = []
+
+    positional = [parameter for parameter in parameters
+                  if parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)]
+    if len(positional) > 1 or any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters):
+        return function
+
+    def Extract(file_name, settings=None):
+        return function(file_name)
+    return Extract
+
+
+def ProcessModulesIter(file_name):
+    """
+    Process the modules based on the file extension, like ProcessModules,
+    but returns a generator function yielding the exportables one by one.
+    Modules without their own IterExtract function yield the list
+    returned by Extract.
+
+    Args:
+        file_name (str): The name of the file.
+
+    Returns:
+        tuple: A tuple containing the generator function and module data.
+
+    Raises:
+        Exception: If the file type is unrecognized.
+
+    """
+    Extract, module_data = ProcessModules(file_name)
+    extract_module = modules.__modules__[file_name.split('.')[-1]]
+    if hasattr(extract_module, 'IterExtract'):
+        return WithSettings(extract_module.IterExtract), module_data
+
+    def IterExtract(file_name, settings=None):
+        yield from Extract(file_name, settings)
+    return IterExtract, module_data
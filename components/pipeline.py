@@ -0,0 +1,107 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import queue
+import threading
+
+# Size of reads when prefetching the input files
+PREFETCH_CHUNK_SIZE = 1 << 20
+
+
+# Yields file names while a background thread reads ahead
+# up to depth next files. Modules open the files by name
+# themselves, reading them ahead pulls them into the os
+# file cache, so they no longer wait for the disk.
+# An exception that stops the thread is raised again
+# in place of the file names it did not get to.
+def ReadAhead(file_names, depth):
+    prefetched = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    # Give up waiting for a free slot once the consumer stops
+    def Put(item):
+        while not stop.is_set():
+            try:
+                prefetched.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def Prefetch():
+        try:
+            for file_name in file_names:
+                try:
+                    with open(file_name, 'rb') as f:
+                        while not stop.is_set() and f.read(PREFETCH_CHUNK_SIZE):
+                            pass
+                except OSError:
+                    # Left for the module to report
+                    pass
+
+                if not Put(file_name):
+                    return
+        except BaseException as exception:
+            Put(exception)
+
+    thread = threading.Thread(target=Prefetch, name='ReadAhead', daemon=True)
+    thread.start()
+    try:
+        for _ in file_names:
+            file_name = prefetched.get()
+            if isinstance(file_name, BaseException):
+                raise file_name
+            yield file_name
+    finally:
+        stop.set()
+
+
+class WriteBehind:
+    '''
+    Runs calls of self.function on a background thread, in order.
+    Up to depth calls can wait in the queue, further ones block
+    until the writer catches up, keeping the memory capped.
+    Exceptions raised by the writer are raised again by the
+    next self.put() or self.close() call.
+    The thread is not a daemon, so the queued calls are not lost
+    at exit, self.close() has to be called once done.
+    '''
+    def __init__(self, function, depth):
+        self.function = function
+        self._queue = queue.Queue(maxsize=depth)
+        self._exception = None
+        self._thread = threading.Thread(target=self._run, name='WriteBehind')
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            args = self._queue.get()
+            if args is None:
+                return
+            # Skip the remaining calls after a failure
+            if self._exception is not None:
+                continue
+            try:
+                self.function(*args)
+            except BaseException as exception:
+                self._exception = exception
+
+    def _raise_exception(self):
+        if self._exception is not None:
+            exception, self._exception = self._exception, None
+            raise exception
+
+    def put(self, *args):
+        self._raise_exception()
+        self._queue.put(args)
+
+    def close(self):
+        '''
+        Waits for all queued calls to finish.
+        '''
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_exception()
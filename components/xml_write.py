@@ -9,37 +9,179 @@
 
 import re
 import os
+import contextlib
 
 from components.logger import GetLogger
 logger = GetLogger()
 
+# Placeholder syntax grabbed directly from Bootshuze
+PLACEHOLDER_REGEX = re.compile(r'(?:{{ )([a-zA-Z_]*)(?: }})')
+
+# Compiled templates, template name: (mtime, segments)
+templates_cache = {}
+
+
 # Export args data to the output file
-# Based on the selected template
-def ExportXML(file_name, template, args):
+# Based on the selected template.
+# Args can be either strings or Serializable
+# objects, the latter are streamed into the file.
+# Output files are claimed through the allocator,
+# a single use one is created if none is given.
+def ExportXML(file_name, template, args, allocator=None):
+
+    # Raises FileNotFoundError for missing templates
+    # before any output file gets created
+    segments = CompileTemplate(template)
+
+    if allocator is None:
+        allocator = OutputAllocator()
+
+    with allocator.open(file_name) as o:
+        RenderTemplate(o, segments, args)
+    logger.info('Finished writing to "%s"', o.name)
+
+
+class OutputAllocator:
+    '''
+    Allocates output xml files for input files.
+    - self.output_dir: Directory for the output files, None
+      writes them next to the input files.
+    - self.overwrite: Overwrite existing output files instead of
+      patching up new "name(n).xml" file names. Only the first
+      output of an input overwrites "name.xml", the next ones
+      overwrite "name(n).xml" in the order they are claimed.
+
+    Every output directory is listed only once, the taken names are
+    then kept in memory. Files are claimed with an exclusive create,
+    so concurrent runs never write to the same file.
+    Allocators created with a multiprocessing manager keep their state
+    in it, so that they can be shared by worker processes.
+    '''
+    def __init__(self, output_dir=None, overwrite=False, manager=None):
+        self.output_dir = output_dir
+        self.overwrite = overwrite
+        if manager is None:
+            self._taken_names = {}
+            self._next_numbers = {}
+            self._lock = contextlib.nullcontext()
+        else:
+            self._taken_names = manager.dict()
+            self._next_numbers = manager.dict()
+            self._lock = manager.Lock()
+
+    def _get_taken_names(self, directory):
+        if directory not in self._taken_names:
+            try:
+                self._taken_names[directory] = set(os.listdir(directory or '.'))
+            except FileNotFoundError:
+                self._taken_names[directory] = set()
+        return self._taken_names[directory]
+
+    def open(self, file_name):
+        '''
+        Claims an output file for the input file and opens it for writing.
+
+        Args:
+            file_name (str): Input file name.
+
+        Returns:
+            file object: Output file opened in text mode.
+        '''
+        # Trim out the extension, the appropriate one gets added
+        directory, stem = os.path.split(file_name.rsplit('.', 1)[0])
+        if self.output_dir is not None:
+            directory = self.output_dir
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            return self._open(directory, stem)
+
+    def _open(self, directory, stem):
+        if self.overwrite:
+            # Outputs claimed earlier in this run must not get overwritten
+            file_number = self._next_numbers.get((directory, stem), 0)
+            self._next_numbers[(directory, stem)] = file_number + 1
+            name = f'{stem}({file_number}).xml' if file_number else f'{stem}.xml'
+            return open(os.path.join(directory, name), 'w')
+
+        # In case a file with the same name exists
+        # patch up a new file name.
+        taken_names = self._get_taken_names(directory)
+        file_number = self._next_numbers.get((directory, stem), 0)
+        try:
+            while True:
+                name = f'{stem}({file_number}).xml' if file_number else f'{stem}.xml'
+                file_number += 1
+                if name in taken_names:
+                    continue
+
+                try:
+                    fp = open(os.path.join(directory, name), 'x')
+                except FileExistsError:
+                    # Created by someone else after listing the directory
+                    taken_names.add(name)
+                    continue
+
+                taken_names.add(name)
+                self._next_numbers[(directory, stem)] = file_number
+                return fp
+
+        finally:
+            # Sets kept by a manager are copies, store them back
+            self._taken_names[directory] = taken_names
+
+
+def CompileTemplate(template):
+    '''
+    Splits a template into a list of literal text and placeholder segments.
+    Compiled templates are cached until their file gets modified.
+
+    Args:
+        template (str): Template file name in the templates directory.
+
+    Returns:
+        list: (is_placeholder, text) tuples, text being a placeholder name
+              or literal text respectively.
+    '''
+    template_path = f'templates/{template}'
+    mtime = os.stat(template_path).st_mtime_ns
 
-    # Trim out the extension and add an appropriate one
-    export_file = file_name.rsplit('.', 1)[0] + '.xml'
+    cached = templates_cache.get(template)
+    if cached and cached[0] == mtime:
+        return cached[1]
 
-    # In case a file with the same name exists
-    # patch up a new file name.
-    file_number = 1
+    with open(template_path, 'r') as i:
+        text = i.read()
 
-    while os.path.isfile(export_file):
-        export_file = file_name.rsplit('.', 1)[0] + f'({file_number})' + '.xml'
-        file_number += 1
+    segments = []
+    position = 0
+    for match in PLACEHOLDER_REGEX.finditer(text):
+        segments.append((False, text[position:match.start()]))
+        segments.append((True, match.group(1)))
+        position = match.end()
+    segments.append((False, text[position:]))
 
-    # Prepare to write to output file
-    with open(f'{export_file}', 'w+') as o, \
-            open(f'templates/{template}', 'r') as i:
+    templates_cache[template] = (mtime, segments)
+    return segments
 
-        # Write to output file using regex substitution
-        # Grabbed directly from Bootshuze
-        regex = re.compile(r'(?:{{ )([a-zA-Z_]*)(?: }})')
 
-        for line in i:
+def RenderTemplate(fp, segments, args):
+    '''
+    Writes compiled template segments into a file object,
+    substituting placeholders with args. Placeholders
+    missing from args are written as they are.
+    '''
+    for is_placeholder, text in segments:
+        if not is_placeholder:
+            fp.write(text)
+        elif text in args:
+            WriteArg(fp, args[text])
+        else:
+            fp.write(f'{{{{ {text} }}}}')
 
-            if any(f'{{ {arg} }}' in line for arg in args.keys()):
-                line = regex.sub(args[regex.search(line).group(1)], line)
 
-            o.write(line)
-    logger.info('Finished writing to "%s"', o.name)
\ No newline at end of file
+def WriteArg(fp, arg):
+    if isinstance(arg, str):
+        fp.write(arg)
+    else:
+        arg.write(fp)
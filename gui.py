@@ -8,6 +8,7 @@
 from webbrowser import open as OpenURL
 import PySimpleGUI as sg
 import threading
+import os
 
 # Internal Imports
 from main import RestoreFiles, CheckUpdates, ModuleData, Main, Settings
@@ -185,7 +186,19 @@ def GuiMenu():
                         tooltip='Necessary for reimporting armors')
         ],
         [
-            sg.Combo(['Opt1', 'Opt2'], readonly=True, visible=False, default_value='Opt1')
+            sg.Checkbox('Compact output', visible=True, key='_COMPACT-OUTPUT_',
+                        tooltip='Separate exported values with "," instead of ", "')
+        ],
+        [
+            sg.Text('Parallel jobs'),
+            sg.Spin(list(range(1, (os.cpu_count() or 1) + 1)), initial_value=1, readonly=True,
+                    key='_JOBS_', tooltip='Number of files converted at once')
+        ],
+        [
+            sg.Text('Significant digits'),
+            sg.Combo(['Exact', '9', '7', '6', '5', '4'], readonly=True, default_value='Exact',
+                     key='_PRECISION_', tooltip='Significant digits of exported\n'
+                                                'positions, normals, UVs and weights')
         ]
     ]
     frame_output_type = [
@@ -382,6 +395,11 @@ def GuiMenu():
                     mode = 'Static'
 
                 strip_armature_tree = window['_STRIP-ARMATURE-TREE_'].Get()
+                compact_output = window['_COMPACT-OUTPUT_'].Get()
+                jobs = int(values['_JOBS_'])
+                precision = None
+                if values['_PRECISION_'] != 'Exact':
+                    precision = int(values['_PRECISION_'])
 
                 # Start processing the files
                 if file_names:
@@ -392,7 +410,10 @@ def GuiMenu():
                     processing_lock = True
 
                     settings = Settings(file_names=file_names, model_mode=mode,
-                                        no_export_file=False, strip_armature_tree=strip_armature_tree)
+                                        no_export_file=False, strip_armature_tree=strip_armature_tree,
+                                        precision_positions=precision, precision_normals=precision,
+                                        precision_texcoords=precision, precision_weights=precision,
+                                        compact_output=compact_output, jobs=jobs)
 
                     # Long boi taken directly from PySimpleGUI Cookbook
                     # Creates a separate thread to prevent the program from freezing
@@ -5,8 +5,11 @@
 ###############################################################
 
 # External Imports
-import gc
-from dataclasses import dataclass
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
 
 # Internal Imports
 from components.check_updates      import VERSION_CURRENT
@@ -17,11 +20,22 @@ from components.logger             import EndLogging
 from components.logger             import InitRootLogger
 from components.logger             import SEPARATOR
 from components.logger             import LOGGING_FILE
+from components.logger             import WorkerLogging
+from components.logger             import InitWorkerLogging
 from components.xml_write          import ExportXML
+from components.xml_write          import OutputAllocator
 from components.module_import      import ProcessModules
+from components.module_import      import ProcessModulesIter
+from components.pipeline           import ReadAhead
+from components.pipeline           import WriteBehind
+from components.memory             import GetMemoryGovernor
+from components.memory             import SetMemoryBudget
+from components.memory             import WorkerMemoryBudget
+from components.memory             import MEGABYTE
 from components.module_import      import ModuleData
 from components.module_import      import FILE_TYPES_LIST
 from schema.export                 import SetModelType
+from schema.export                 import SetModelFormat
 from schema.export                 import Model
 from schema.base                   import Exportable
 
@@ -32,67 +46,410 @@ class Settings:
     model_mode: str = 'articulated'
     no_export_file: bool = False
     strip_armature_tree: bool = False
+    geometry_jobs: int = 1
+    stream_collada: bool = False
+    crease_angle: float | None = None
+    precision_positions: int | None = None
+    precision_normals: int | None = None
+    precision_texcoords: int | None = None
+    precision_weights: int | None = None
+    compact_output: bool = False
+    output_dir: str | None = None
+    overwrite_output: bool = False
+    pipeline_depth: int = 0
+    jobs: int = 1
+    memory_budget: int | None = None
+
+    def __post_init__(self):
+        # Checked before any output gets written, '%.-1g' only fails while writing
+        for name in ('precision_positions', 'precision_normals', 'precision_texcoords', 'precision_weights'):
+            precision = getattr(self, name)
+            if precision is not None and precision < 1:
+                raise ValueError(f'{name} has to be at least 1, found {precision}')
+
+
+@dataclass
+class ConvertResult:
+    '''
+    Outcome of converting a single file.
+    - self.exportables: Extracted exportables, only kept with no_export_file
+    - self.error: Error message if the conversion failed
+    - self.peak_rss: Peak memory sampled while converting, only with a memory budget
+    '''
+    file_name: str
+    exportables: list | None = None
+    error: str | None = None
+    peak_rss: int = 0
 
 
 def Main(settings: Settings):
 
     InitRootLogger()
     logger = GetLogger()
-    for file_name in settings.file_names:
+    SetMemoryBudget(settings.memory_budget * MEGABYTE if settings.memory_budget else None)
 
-        try:
-            logger.info('Processing: "%s"...', file_name)
+    if settings.jobs > 1 and len(settings.file_names) > 1:
+        results = MainParallel(settings)
+
+        # Failures were logged, the remaining files got converted
+        failed = [result for result in results if result.error is not None]
+        if failed:
+            raise Exception(f'Failed to convert {len(failed)} of {len(results)} files.')
+
+        if settings.no_export_file:
+            return [exportable for result in results for exportable in result.exportables]
+        return
+
+    allocator = OutputAllocator(settings.output_dir, settings.overwrite_output)
 
-            Extract, module_data = ProcessModules(file_name)
-            logger.debug('Using "%s" module.', module_data["Name"])
-            exportables_list = Extract(file_name)
-            logger.info('Finished extracting the model data.')
+    # Pipelined batch mode, reads the next files ahead
+    # and writes the outputs behind the extraction
+    file_names = settings.file_names
+    writer = None
+    if settings.pipeline_depth > 0:
+        file_names = ReadAhead(settings.file_names, settings.pipeline_depth)
+        if not settings.no_export_file:
+            writer = WriteBehind(WriteExportable, settings.pipeline_depth)
 
-            for exportable in exportables_list:
+    # Exportables of all files, only kept with no_export_file
+    all_exportables = []
 
-                if not isinstance(exportable, Exportable):
-                    raise Exception(f'Unknown non-exportable type: {type(exportable)}')
+    try:
+        for file_name in file_names:
 
-                # Set template to exportable's
-                template = exportable.template_file
+            try:
+                exportables_list = ConvertFile(file_name, settings, allocator, writer)
 
-                if type(exportable) is Model:
-                    logger.debug('Converting model to "%s" mode...', settings.model_mode)
-                    exportable = SetModelType(exportable, settings.model_mode)
+                if settings.no_export_file:
+                    all_exportables.extend(exportables_list)
 
-                    # Option necessary for importing armors.
-                    # Erases "bones" tag to fix armor armature
-                    # conflicting with pc model armature.
-                    if settings.strip_armature_tree:
-                        logger.debug('Stripped armature data.')
-                        exportable.armature = None
+                del exportables_list
+                GetMemoryGovernor().checkpoint()
+                logger.info(SEPARATOR)
+
+            except:
+                logger.exception('Unhandled exception ocurred!')
+                raise
+
+            finally:
+                EndLogging()
+
+    # Stop reading ahead and wait for the outputs still queued
+    # in the pipeline, also when one of the files failed
+    finally:
+        if settings.pipeline_depth > 0:
+            file_names.close()
+        if writer:
+            try:
+                writer.close()
+            except:
+                logger.exception('Unhandled exception ocurred!')
+                raise
+
+    if settings.no_export_file:
+        return all_exportables
+
+
+def IterConvert(settings: Settings):
+    """
+    Converts the files one by one, yielding a result as soon as it is ready:
+    one per exportable, so one per geometry of a multi-geometry collada file.
+    Each exportable is written to xml before being yielded, unless
+    settings.no_export_file is set, and is released by the converter
+    once the consumer asks for the next result.
+    A failed file yields a result with the error and does not stop the remaining ones.
+    Files are converted in the calling process, settings.jobs and settings.pipeline_depth
+    are not used. With settings.geometry_jobs, only as many collada geometries
+    are converted ahead of the consumer as there are geometry workers.
+
+    Args:
+        settings (Settings): Conversion settings.
+
+    Yields:
+        ConvertResult: Result holding a single exportable, or the error of a failed file.
+    """
+    InitRootLogger()
+    logger = GetLogger()
+    governor = GetMemoryGovernor()
+    SetMemoryBudget(settings.memory_budget * MEGABYTE if settings.memory_budget else None)
+    allocator = OutputAllocator(settings.output_dir, settings.overwrite_output)
 
+    try:
+        for file_name in settings.file_names:
+            logger.info('Processing: "%s"...', file_name)
+            governor.reset_peak()
+            try:
+                IterExtract, module_data = ProcessModulesIter(file_name)
+                logger.debug('Using "%s" module.', module_data["Name"])
 
-                else:
-                    raise Exception(f'Unknown exportable type: {type(exportable)}')
+                for exportable in IterExtract(file_name, settings):
+                    template, exportable = ConvertExportable(exportable, settings)
+                    if not settings.no_export_file:
+                        WriteExportable(file_name, template, exportable, allocator)
 
-                if not settings.no_export_file:
-                    try:
-                        logger.info('Writing model data to xml...')
-                        ExportXML(file_name, template, exportable.toargs())
+                    result = ConvertResult(file_name, exportables=[exportable], peak_rss=governor.peak)
+                    del exportable
+                    yield result
 
-                    except FileNotFoundError:
-                        logger.error('Template files not found! '
-                                     'Attempting to restore the files from Options...')
-                        RestoreFiles()
-                        logger.info('Retrying to write to XML...')
-                        ExportXML(file_name, template, exportable.toargs())
+                    # The consumer holds the only reference left
+                    del result
+                    governor.checkpoint()
 
-            if settings.no_export_file:
-                return exportables_list
+            except Exception as exception:
+                logger.exception('Unhandled exception ocurred while processing "%s"!', file_name)
+                yield ConvertResult(file_name, error=f'{type(exception).__name__}: {exception}',
+                                    peak_rss=governor.peak)
+                continue
 
-            del exportables_list
-            gc.collect()
+            logger.info('Finished processing the file.')
             logger.info(SEPARATOR)
 
-        except:
-            logger.exception('Unhandled exception ocurred!')
-            raise
+    finally:
+        EndLogging()
+
+
+def MainParallel(settings: Settings):
+    """
+    Converts the files on a pool of settings.jobs worker processes, largest files first.
+    A failed file is logged and does not stop the remaining ones.
+    If a worker process dies, the pool is recreated and the files it was
+    converting are retried one at a time, a file that kills a worker
+    converting it alone fails.
+    With a memory budget, fewer files are converted at once if the
+    peak memory of the workers shows that they would not fit.
+
+    Args:
+        settings (Settings): Conversion settings.
+
+    Returns:
+        list[ConvertResult]: Results in the order of settings.file_names.
+    """
+    logger = GetLogger()
+
+    # Missing files are left for the workers to report
+    def FileSize(file_name):
+        try:
+            return os.path.getsize(file_name)
+        except OSError:
+            return 0
+    order = sorted(range(len(settings.file_names)),
+                   key=lambda i: FileSize(settings.file_names[i]), reverse=True)
+
+    # Every file already runs on its own core
+    worker_settings = replace(settings, jobs=1, geometry_jobs=1, pipeline_depth=0)
+
+    results = [None]*len(settings.file_names)
+    governor = GetMemoryGovernor()
+    jobs_limit = settings.jobs
+    peak_rss = 0
+
+    # Files not finished yet, and the ones converted when a worker died
+    remaining = list(order)
+    isolated = set()
+
+    # Workers share the allocator, so that they number the outputs like the serial path
+    manager = multiprocessing.Manager()
+    allocator = OutputAllocator(settings.output_dir, settings.overwrite_output, manager)
+
+    try:
+        while remaining:
+            # Worker processes log through the handlers of this process. Every pool
+            # gets its own queue, a dead worker may leave the lock of the last one taken.
+            with WorkerLogging() as log_queue:
+                with ProcessPoolExecutor(max_workers=settings.jobs, initializer=InitFileWorker,
+                                         initargs=(worker_settings, log_queue, allocator,
+                                                   WorkerMemoryBudget(settings.jobs))) as executor:
+
+                    # Isolated files go first, one at a time
+                    pending = iter(sorted(remaining, key=lambda i: i not in isolated))
+                    futures = {}
+                    broken = False
+                    while not broken:
+                        # Files are submitted only as long as they are within the jobs limit
+                        limit = 1 if isolated.intersection(remaining) else jobs_limit
+                        for i in pending:
+                            futures[executor.submit(ConvertFileWorker, settings.file_names[i])] = i
+                            if len(futures) >= limit:
+                                break
+                        if not futures:
+                            break
+
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            i = futures.pop(future)
+                            try:
+                                result = future.result()
+                            except BrokenProcessPool as exception:
+                                broken = True
+                                if i not in isolated:
+                                    isolated.add(i)
+                                    continue
+                                result = ConvertResult(settings.file_names[i],
+                                                       error=f'{type(exception).__name__}: {exception}')
+                            results[i] = result
+                            remaining.remove(i)
+                            peak_rss = max(peak_rss, result.peak_rss)
+
+                        # Every file in flight fails along with the pool,
+                        # unless it has finished in the meantime
+                        if broken:
+                            logger.warning('A worker process died, restarting the workers...')
+                            for future, i in futures.items():
+                                if future.done() and not future.cancelled() and future.exception() is None:
+                                    results[i] = future.result()
+                                    remaining.remove(i)
+                                else:
+                                    isolated.add(i)
+                            break
+
+                        new_jobs_limit = governor.allowed_jobs(settings.jobs, peak_rss)
+                        if new_jobs_limit != jobs_limit:
+                            logger.info('Memory budget allows %s files at once.', new_jobs_limit)
+                            jobs_limit = new_jobs_limit
+
+    finally:
+        manager.shutdown()
+
+    failed = [result for result in results if result.error is not None]
+    for result in failed:
+        logger.error('Failed to convert "%s": %s', result.file_name, result.error)
+    logger.info('Converted %d of %d files.', len(results) - len(failed), len(results))
+    EndLogging()
+    return results
+
+
+def InitFileWorker(settings: Settings, log_queue, allocator, memory_budget=None):
+    """
+    Initializer of the file worker processes.
+    """
+    global _worker_settings, _worker_allocator
+
+    InitWorkerLogging(log_queue)
+
+    # Workers get a share of the budget, their peaks steer the jobs limit
+    SetMemoryBudget(memory_budget)
+
+    _worker_settings = settings
+    _worker_allocator = allocator
+
+
+def ConvertFileWorker(file_name):
+    """
+    Converts a single file within a worker process, catching its errors.
+
+    Returns:
+        ConvertResult: Result of the conversion.
+    """
+    logger = GetLogger()
+    governor = GetMemoryGovernor()
+    governor.reset_peak()
+    try:
+        exportables_list = ConvertFile(file_name, _worker_settings, _worker_allocator)
+    except Exception as exception:
+        logger.exception('Unhandled exception ocurred while processing "%s"!', file_name)
+        return ConvertResult(file_name, error=f'{type(exception).__name__}: {exception}',
+                             peak_rss=governor.peak)
+
+    if not _worker_settings.no_export_file:
+        exportables_list = None
+    governor.checkpoint()
+    logger.info(SEPARATOR)
+    return ConvertResult(file_name, exportables=exportables_list, peak_rss=governor.peak)
+
+
+def ConvertFile(file_name, settings: Settings, allocator, writer=None):
+    """
+    Extracts a single file and writes its exportables to xml,
+    unless settings.no_export_file is set.
+
+    Args:
+        file_name (str): Input file name.
+        settings (Settings): Conversion settings.
+        allocator (OutputAllocator): Allocator of the output files.
+        writer (WriteBehind, optional): Background writer of the outputs. Defaults to None (write in place).
+
+    Returns:
+        list: Exportables extracted from the file.
+    """
+    logger = GetLogger()
+    governor = GetMemoryGovernor()
+    logger.info('Processing: "%s"...', file_name)
+
+    Extract, module_data = ProcessModules(file_name)
+    logger.debug('Using "%s" module.', module_data["Name"])
+    with governor.stage('extract'):
+        exportables_list = Extract(file_name, settings)
+    logger.info('Finished extracting the model data.')
+
+    for exportable in exportables_list:
+        with governor.stage('convert'):
+            template, exportable = ConvertExportable(exportable, settings)
+
+        if writer:
+            writer.put(file_name, template, exportable, allocator)
+        elif not settings.no_export_file:
+            with governor.stage('write'):
+                WriteExportable(file_name, template, exportable, allocator)
+
+    return exportables_list
+
+
+def ConvertExportable(exportable, settings: Settings):
+    """
+    Converts an extracted exportable according to the settings.
+
+    Args:
+        exportable (Exportable): Exportable returned by a module.
+        settings (Settings): Conversion settings.
+
+    Returns:
+        tuple: The template file name and the converted exportable.
+
+    Raises:
+        Exception: If the exportable type is unknown.
+    """
+    logger = GetLogger()
+    if not isinstance(exportable, Exportable):
+        raise Exception(f'Unknown non-exportable type: {type(exportable)}')
+
+    # Set template to exportable's
+    template = exportable.template_file
+
+    if type(exportable) is Model:
+        logger.debug('Converting model to "%s" mode...', settings.model_mode)
+        exportable = SetModelType(exportable, settings.model_mode)
+
+        # Option necessary for importing armors.
+        # Erases "bones" tag to fix armor armature
+        # conflicting with pc model armature.
+        if settings.strip_armature_tree:
+            logger.debug('Stripped armature data.')
+            exportable.armature = None
+
+        precisions = (settings.precision_positions, settings.precision_normals,
+                      settings.precision_texcoords, settings.precision_weights)
+        if settings.compact_output or any(precision is not None for precision in precisions):
+            saved = SetModelFormat(exportable, *precisions, compact=settings.compact_output)
+            logger.info('Output number format saves about %d bytes.', saved)
+
+    else:
+        raise Exception(f'Unknown exportable type: {type(exportable)}')
+
+    return template, exportable
+
+
+def WriteExportable(file_name, template, exportable, allocator):
+    """
+    Writes an exportable to xml, restoring the template files if they are missing.
+    """
+    logger = GetLogger()
+    try:
+        logger.info('Writing model data to xml...')
+        ExportXML(file_name, template, exportable.toargs(), allocator)
 
-        finally:
-            EndLogging()
+    except FileNotFoundError:
+        logger.error('Template files not found! '
+                     'Attempting to restore the files from Options...')
+        RestoreFiles()
+        logger.info('Retrying to write to XML...')
+        ExportXML(file_name, template, exportable.toargs(), allocator)
@@ -4,12 +4,24 @@
 # Github: https://github.com/Crowfunder                       #
 ###############################################################
 
-import gc
+import os
 import re
+import collections
+import math
 import collada
+import numpy as np
+import multiprocessing
+from dataclasses import dataclass, field
+from xml.etree import ElementTree
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+if os.name == 'posix':
+    from multiprocessing import resource_tracker
 
 from schema.model           import *
-from components.logger      import GetLogger
+from components.logger      import GetLogger, WorkerLogging, InitWorkerLogging
+from components.memory      import GetMemoryGovernor, SetMemoryBudget, WorkerMemoryBudget
+from components.mesh        import DeduplicateCorners, TriangulatePolygons
 
 logger = GetLogger()
 
@@ -23,26 +35,331 @@ module_data = {
     'Multimaterial' : True,
 }
 
+# Xml tags of the node transforms
+TRANSFORM_TAGS = ['translate', 'rotate', 'scale', 'matrix', 'lookat']
 
+# Libraries kept as xml by ColladaStream, everything else is freed once read
+STREAM_KEPT_LIBRARIES = ['library_visual_scenes', 'library_materials']
 
-def ListFlatten(input_list):
-    """
-    Flattens a nested list into a single-level list.
+# Xml tags of the mesh primitives loaded by PyCollada
+PRIMITIVE_TAGS = ['triangles', 'tristrips', 'trifans', 'polylist', 'polygons', 'lines']
 
-    Args:
-        input_list (list[list]): The nested list to be flattened.
+# Rough memory use of an opened document, per byte of the file
+COLLADA_MEMORY_FACTOR = 8
 
-    Returns:
-        list: The flattened list.
-    """
-    while type(input_list[0]) is list:
-        input_list = [item for sublist in input_list for item in sublist]
 
-    return input_list
+
+class ColladaDocument(collada.Collada):
+    '''
+    Collada document loading only the geometries and controllers libraries.
+    Every other library is left unloaded, materials are only needed as ids and
+    the armature is read straight from the scenes xml by IndexDocument,
+    which are both far cheaper than building PyCollada objects for them.
+    '''
+    def _loadImages(self):
+        pass
+
+    def _loadEffects(self):
+        pass
+
+    def _loadMaterials(self):
+        pass
+
+    def _loadAnimations(self):
+        pass
+
+    def _loadLights(self):
+        pass
+
+    def _loadCameras(self):
+        pass
+
+    def _loadNodes(self):
+        pass
+
+    def _loadScenes(self):
+        pass
+
+    def _loadDefaultScene(self):
+        pass
+
+
+class ColladaStream(ColladaDocument):
+    '''
+    Collada document read incrementally with iterparse, instead of
+    parsing the whole document into an element tree first.
+    - Geometries are loaded as soon as their element ends.
+    - Skin controllers are read into StreamSkin, decoding vcount
+      and v in bulk, without per vertex bookkeeping.
+    - Elements are freed right after being read, only the scenes
+      and materials libraries are kept as xml for IndexDocument.
+    Produces the same geometries as ColladaDocument.
+    '''
+    def __init__(self, file_name):
+
+        # Initialize an empty document
+        super().__init__()
+        self.filename = file_name
+
+        root = None
+        depth = 0
+        skins = []
+        for event, element in ElementTree.iterparse(file_name, events=('start', 'end')):
+            if event == 'start':
+                if root is None:
+                    root = element
+                    namespace = root.tag.split('}')[0].lstrip('{')
+                    self.tag = collada.common.tagger(namespace)
+                depth += 1
+                continue
+            depth -= 1
+
+            if element.tag == self.tag('geometry'):
+                if element.find(self.tag('mesh')) is not None:
+                    self.geometries.append(collada.geometry.Geometry.load(self, {}, element))
+                FreeElement(element)
+
+            elif element.tag == self.tag('controller'):
+                skin_node = element.find(self.tag('skin'))
+                if skin_node is not None:
+                    skins.append(StreamSkin.load(self, element, skin_node))
+                FreeElement(element)
+
+            elif depth == 1 and element.tag not in [self.tag(name) for name in STREAM_KEPT_LIBRARIES]:
+                element.clear()
+
+        # Controllers may come before geometries within the document
+        for skin in skins:
+            if skin.geometry not in self.geometries:
+                raise collada.common.DaeBrokenRefError('Source geometry for skin node not found')
+            skin.geometry = self.geometries[skin.geometry]
+            self.controllers.append(skin)
+
+        self.xmlnode = ElementTree.ElementTree(root)
+
+
+@dataclass
+class StreamSkin:
+    '''
+    Skin controller read by ColladaStream, holds the same data
+    PyCollada skins do, as far as ExtractControllers is concerned.
+    - self.geometry: Deformed geometry.
+    - self.weights: Source of the weights.
+    - self.weight_joints: Source of the joint names.
+    - self.vcounts: Number of influences of every vertex.
+    - self.vertex_weight_index: Flat <v> indices.
+    - self.offsets: Offsets of the joint and weight inputs in the indices.
+    - self.nindices: Number of inputs in the indices.
+    '''
+    id: str
+    geometry: collada.geometry.Geometry
+    weights: collada.source.FloatSource
+    weight_joints: collada.source.NameSource
+    vcounts: np.ndarray
+    vertex_weight_index: np.ndarray
+    offsets: list
+    nindices: int
+
+    @staticmethod
+    def load(mesh, controller_node, skin_node):
+        '''
+        Reads a <skin> xml node, the geometry is left as its id until all geometries are loaded.
+        '''
+        tag = mesh.tag
+        sources = {}
+        for source_node in skin_node.findall(tag('source')):
+            source = collada.source.Source.load(mesh, {}, source_node)
+            sources[source.id] = source
+
+        weights_node = skin_node.find(tag('vertex_weights'))
+        if weights_node is None \
+                or weights_node.find(tag('v')) is None \
+                or weights_node.find(tag('vcount')) is None:
+            raise collada.common.DaeIncompleteError('Missing vertex weights in skin')
+
+        inputs = {}
+        for input_node in weights_node.findall(tag('input')):
+            inputs[input_node.get('semantic')] = (input_node.get('source', '').replace('#', ''),
+                                                  int(input_node.get('offset')))
+        if 'JOINT' not in inputs or 'WEIGHT' not in inputs:
+            raise collada.common.DaeMalformedError('Not enough inputs for vertex weights in skin')
+        if inputs['JOINT'][0] not in sources or inputs['WEIGHT'][0] not in sources:
+            raise collada.common.DaeBrokenRefError('Weights input in joints not found')
+
+        offsets = [inputs['JOINT'][1], inputs['WEIGHT'][1]]
+        return StreamSkin(id=controller_node.get('id'),
+                          geometry=skin_node.get('source', '').replace('#', ''),
+                          weights=sources[inputs['WEIGHT'][0]],
+                          weight_joints=sources[inputs['JOINT'][0]],
+                          vcounts=ParseArray(weights_node.find(tag('vcount')).text, np.int32),
+                          vertex_weight_index=ParseArray(weights_node.find(tag('v')).text, np.float64).astype(np.int32),
+                          offsets=offsets,
+                          nindices=max(offsets) + 1)
+
+
+@dataclass
+class ColladaIndex:
+    '''
+    Lookup tables of a single collada document, built once and shared by all of its geometries.
+    - self.skins: Geometry id to the skin controller deforming it.
+    - self.controller_nodes: Controller id to the <node> xml node instancing the controller.
+    - self.skeletons: Controller id to the id of the armature starting node pointed by its <skeleton>.
+    - self.nodes: Node id to the <node> xml node.
+    - self.materials: Ids of all materials in the materials library.
+    - self.scenes: Number of visual scenes in the document.
+    '''
+    skins: dict = field(default_factory=dict)
+    controller_nodes: dict = field(default_factory=dict)
+    skeletons: dict = field(default_factory=dict)
+    nodes: dict = field(default_factory=dict)
+    materials: list = field(default_factory=list)
+    scenes: int = 0
+
+
+@dataclass
+class SharedArray:
+    '''
+    Placeholder left in place of an array moved to shared memory by ModelToShared.
+    - self.offset: Position of the array data in the shared memory block, in bytes.
+    - self.dtype: Array dtype string.
+    - self.shape: Array shape.
+    '''
+    offset: int
+    dtype: str
+    shape: tuple
 
 
 
-def Extract(file_name):
+# Document opened by a geometry worker process, set by InitGeometryWorker.
+# On Windows shared memory blocks created by the worker have to outlive the task
+# that created them, as a block is gone once its last handle is closed. They are
+# kept with the geometry position until the main process consumes the geometry,
+# it publishes the position all geometries before which are consumed.
+_worker_document = None
+_worker_shared_memory = []
+_worker_consumed = None
+
+
+
+def Extract(file_name, settings=None):
+    return list(IterExtract(file_name, settings))
+
+
+def IterExtract(file_name, settings=None):
+    '''
+    Yields the Model of every geometry as soon as it is converted.
+    With several geometry jobs the document is only scanned for its
+    geometries here, it gets parsed by the worker processes alone.
+    '''
+    positions = None
+    geometry_jobs = settings.geometry_jobs if settings else 1
+    if geometry_jobs > 1:
+        logger.info('Scanning input model file...')
+        positions, loaded_num = ScanGeometries(file_name)
+        CheckGeometries(len(positions), loaded_num)
+
+        geometry_jobs = min(geometry_jobs, len(positions))
+        if geometry_jobs > 1:
+            # Every worker opens its own copy of the document
+            wanted_jobs = geometry_jobs
+            geometry_jobs = GetMemoryGovernor().allowed_jobs(wanted_jobs, DocumentMemoryEstimate(file_name))
+            if geometry_jobs < wanted_jobs:
+                logger.info('Memory budget allows only %s geometry workers.', geometry_jobs)
+        if geometry_jobs > 1:
+            logger.info('Processing geometries with %s workers...', geometry_jobs)
+            yield from ExtractParallel(file_name, settings, positions, geometry_jobs)
+            return
+
+    logger.info('Reading input model file...')
+    mesh = OpenDocument(file_name, settings)
+
+    geometries = [geometry for geometry in mesh.geometries if geometry.primitives != []]
+    if positions is None:
+        CheckGeometries(len(geometries), len(mesh.geometries))
+    geometries_num = len(geometries)
+
+    # Index the document once, instead of searching it for every geometry
+    index = IndexDocument(mesh)
+    logger.info('Found %s materials.', len(index.materials))
+
+    # Iterate through all geometries
+    for geometry in geometries:
+
+        logger.info('Processing geometry: "%s"', geometry.id)
+        yield ExtractGeometry(mesh, index, geometry, settings)
+
+        geometries_num -= 1
+        logger.info('Done! %s remaining.', geometries_num)
+        GetMemoryGovernor().checkpoint()
+
+
+def CheckGeometries(valid_num, loaded_num):
+    '''
+    Logs the number of valid geometries, raises if there are none.
+    '''
+    if valid_num < loaded_num:
+        logger.info('Removing empty geometries...')
+
+    if valid_num > 0:
+        logger.info('Found %s valid geometries!', valid_num)
+    else:
+        raise Exception('Missing model geometry')
+
+
+def ScanGeometries(file_name):
+    '''
+    Finds the geometries of a document in a single iterparse pass,
+    without loading them. Geometries are loaded only if they have
+    a <mesh>, they are valid if it has any primitives.
+
+    Args:
+        file_name (str): Path to the collada document.
+
+    Returns:
+        tuple: Positions of the valid geometries among the loaded ones,
+               and the number of the loaded ones.
+    '''
+    positions = []
+    loaded_num = 0
+    tag = None
+    depth = 0
+    for event, element in ElementTree.iterparse(file_name, events=('start', 'end')):
+        if event == 'start':
+            if tag is None:
+                namespace = element.tag.split('}')[0].lstrip('{')
+                tag = collada.common.tagger(namespace)
+                primitive_tags = [tag(name) for name in PRIMITIVE_TAGS]
+            depth += 1
+            continue
+        depth -= 1
+
+        if element.tag == tag('geometry'):
+            mesh_node = element.find(tag('mesh'))
+            if mesh_node is not None:
+                if any(node.tag in primitive_tags for node in mesh_node):
+                    positions.append(loaded_num)
+                loaded_num += 1
+            element.clear()
+
+        elif depth == 1:
+            element.clear()
+
+    return positions, loaded_num
+
+
+def ExtractGeometry(mesh, index, geometry, settings=None):
+    '''
+    Converts a single collada geometry into a Model.
+
+    Args:
+        mesh (ColladaDocument): Document containing the geometry.
+        index (ColladaIndex): Lookup tables of the document.
+        geometry (collada.geometry.Geometry): The geometry to convert.
+        settings (Settings, optional): Run settings, decide what parts of the document are read.
+
+    Returns:
+        Model: Model containing the geometry primitives, materials and armature.
+    '''
 
     # I'm still not sure how the tag works in the engine, it can stay as default
     # since it checks both texture name and tag to connect primitives to materials
@@ -50,136 +367,436 @@ def Extract(file_name):
     # TODO: Check the engine source if it *really* doesn't affect anything
     material_tag = 'default'
 
-    logger.info('Reading input model file...')
-    exportables_list = []
-    mesh = collada.Collada(file_name)
+    materials = ExtractMaterials(material_tag, index)
+    crease_angle = settings.crease_angle if settings else None
+    primitives, vertex_sources = ExtractGeometries(geometry, material_tag, crease_angle)
+    if mesh.controllers:
+        controller = ExtractControllers(index, geometry, primitives, vertex_sources)
+    else:
+        controller = None
 
-    geometries = mesh.geometries
-    if any(geometry.primitives == [] for geometry in mesh.geometries):
-        logger.info('Removing empty geometries...')
-        geometries = [geometry for geometry in geometries if geometry.primitives != []]
+    # The armature tree gets stripped anyway, only the
+    # bone names have to be read from its nodes then.
+    transforms = not (settings and settings.strip_armature_tree)
 
-    geometries_num = len(geometries)
-    if geometries_num > 0:
-        logger.info('Found %s valid geometries!', geometries_num)
+    if index.scenes and controller is not None:
+        armature = ExtractArmature(mesh=mesh, index=index, primitives=primitives,
+                                   controller=controller, transforms=transforms)
     else:
-        raise Exception('Missing model geometry')
+        armature = None
 
+    return Model(primitives=primitives, materials=materials, armature=armature)
 
-    # Iterate through all geometries
-    for geometry in geometries:
 
-        logger.info('Processing geometry: "%s"', geometry.id)
-        materials = ExtractMaterials(material_tag, mesh)
-        primitives, old_vertex_indices = ExtractGeometries(geometry, material_tag)
-        if mesh.controllers:
-            controller = ExtractControllers(mesh, geometry, primitives, old_vertex_indices)
-        else:
-            controller = None
+def ExtractParallel(file_name, settings, positions, geometry_jobs):
+    '''
+    Converts the geometries on a pool of worker processes,
+    every worker opens the document once and converts the geometries
+    it is given by their position. Model arrays are returned through
+    shared memory instead of being pickled. Blocks of the models that were
+    not yielded, if the consumer stops early, are released on the way out.
+    Only geometry_jobs geometries are submitted ahead of the consumer,
+    so that the memory held by the converted models stays bounded.
 
-        if mesh.scenes and controller is not None:
-            armature = ExtractArmature(mesh=mesh, primitives=primitives, controller=controller)
-        else:
-            armature = None
+    Args:
+        file_name (str): Path to the collada document.
+        settings (Settings): Run settings passed to the workers.
+        positions (list[int]): Positions of the valid geometries within the document.
+        geometry_jobs (int): Number of worker processes.
 
-        geometries_num -= 1
-        logger.info('Done! %s remaining.', geometries_num)
-        gc.collect()
-        exportables_list.append(Model(primitives=primitives, materials=materials, armature=armature))
+    Yields:
+        Model: Models in the order of geometries, as soon as they are converted.
+    '''
+
+    # Geometries are consumed in order, the workers release
+    # their handles of the blocks of the ones before it
+    consumed = multiprocessing.Value('q', 0, lock=False)
+
+    # Worker processes log through the handlers of this process
+    with WorkerLogging() as log_queue:
+        with ProcessPoolExecutor(max_workers=geometry_jobs, initializer=InitGeometryWorker,
+                                 initargs=(file_name, settings, log_queue, consumed,
+                                           WorkerMemoryBudget(geometry_jobs))) as executor:
+
+            # Results are collected in submission order, keeping the geometry order
+            pending = iter(positions)
+            futures = collections.deque()
+            geometries_num = len(positions)
+            try:
+                for position in positions:
+                    while len(futures) < geometry_jobs:
+                        next_position = next(pending, None)
+                        if next_position is None:
+                            break
+                        futures.append(executor.submit(ExtractGeometryWorker, next_position))
+
+                    model, shared_memory_name = futures.popleft().result()
+                    model = ModelFromShared(model, shared_memory_name)
+                    consumed.value = position + 1
+                    yield model
+                    geometries_num -= 1
+                    logger.info('Done! %s remaining.', geometries_num)
+
+            finally:
+                # Unlink the blocks of the models never yielded
+                for future in futures:
+                    future.cancel()
+                for future in futures:
+                    if not future.cancelled() and future.exception() is None:
+                        ReleaseShared(future.result()[1])
+
+
+def InitGeometryWorker(file_name, settings, log_queue, consumed, memory_budget=None):
+    '''
+    Initializer of the geometry worker processes, opens and indexes the document.
+    '''
+    global _worker_document, _worker_consumed
+
+    InitWorkerLogging(log_queue)
+    SetMemoryBudget(memory_budget)
+
+    mesh = OpenDocument(file_name, settings)
+    _worker_document = (mesh, IndexDocument(mesh), settings)
+    _worker_consumed = consumed
+
+
+def ExtractGeometryWorker(position):
+    '''
+    Converts the geometry at the given position of the worker document.
+
+    Returns:
+        tuple: Model with its arrays replaced by SharedArray placeholders
+               and the name of the shared memory block containing them.
+    '''
+    ReleaseConsumed()
+    mesh, index, settings = _worker_document
+    geometry = mesh.geometries[position]
+    logger.info('Processing geometry: "%s"', geometry.id)
+    return ModelToShared(ExtractGeometry(mesh, index, geometry, settings), position)
+
+
+def ReleaseConsumed():
+    '''
+    Closes the worker handles of the shared memory blocks
+    of the geometries already consumed by the main process.
+    '''
+    global _worker_shared_memory
+
+    consumed = _worker_consumed.value
+    for position, shared_memory in _worker_shared_memory:
+        if position < consumed:
+            shared_memory.close()
+    _worker_shared_memory = [(position, shared_memory) for position, shared_memory
+                             in _worker_shared_memory if position >= consumed]
+
+
+def ModelArrays(model):
+    '''
+    Yields all data containers of the model primitives.
+    '''
+    for primitive in model.primitives:
+        yield primitive.vertices
+        yield primitive.normals
+        yield primitive.indices
+        yield from primitive.texcoords
+        if type(primitive) is SkinnedPrimitive:
+            yield from primitive.vertex_attribs
+
+
+def ModelToShared(model, position):
+    '''
+    Moves all model arrays into a single newly created shared memory block,
+    leaving SharedArray placeholders in their place.
+
+    Args:
+        model (Model): Model to move the arrays of.
+        position (int): Position of the geometry of the model, the block is kept until it is consumed.
+
+    Returns:
+        tuple: The model and the name of the shared memory block.
+    '''
+    containers = [container for container in ModelArrays(model)
+                  if isinstance(container.data, np.ndarray)]
+    size = sum(container.data.nbytes for container in containers)
+
+    shared_memory = SharedMemory(create=True, size=max(size, 1))
+
+    # The block gets unlinked by the main process, stop the resource
+    # tracker of the worker from reporting it as leaked.
+    if os.name == 'posix':
+        resource_tracker.unregister(shared_memory._name, 'shared_memory')
+
+    offset = 0
+    for container in containers:
+        data = container.data
+        np.ndarray(data.shape, data.dtype, buffer=shared_memory.buf, offset=offset)[...] = data
+        container.data = SharedArray(offset, data.dtype.str, data.shape)
+        offset += data.nbytes
+
+    # On posix the block outlives its handles until it gets unlinked,
+    # so it does not have to stay mapped in the worker
+    if os.name == 'posix':
+        shared_memory.close()
+    else:
+        _worker_shared_memory.append((position, shared_memory))
+
+    return model, shared_memory.name
+
+
+def ModelFromShared(model, shared_memory_name):
+    '''
+    Restores the model arrays moved to shared memory by ModelToShared
+    and releases the shared memory block.
+
+    Args:
+        model (Model): Model with SharedArray placeholders.
+        shared_memory_name (str): Name of the shared memory block.
+
+    Returns:
+        Model: The model with its arrays restored.
+    '''
+    shared_memory = SharedMemory(name=shared_memory_name)
+    try:
+        for container in ModelArrays(model):
+            placeholder = container.data
+            if isinstance(placeholder, SharedArray):
+                container.data = np.ndarray(placeholder.shape, placeholder.dtype,
+                                            buffer=shared_memory.buf,
+                                            offset=placeholder.offset).copy()
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+    return model
+
+
+def ReleaseShared(shared_memory_name):
+    '''
+    Unlinks a shared memory block created by ModelToShared without reading it.
+    '''
+    shared_memory = SharedMemory(name=shared_memory_name)
+    shared_memory.close()
+    shared_memory.unlink()
 
-    return exportables_list
 
+def OpenDocument(file_name, settings=None):
+    '''
+    Opens the collada document with the reader selected by the run settings.
+    Falls back to streaming if the document would not fit in the memory budget.
+    '''
+    if settings and settings.stream_collada:
+        logger.debug('Streaming the document...')
+        return ColladaStream(file_name)
+    if not GetMemoryGovernor().fits(DocumentMemoryEstimate(file_name)):
+        logger.info('Memory budget is tight, streaming the document...')
+        return ColladaStream(file_name)
+    return ColladaDocument(file_name)
+
+
+def DocumentMemoryEstimate(file_name):
+    '''
+    Estimates the memory used by an opened document, in bytes.
+    '''
+    return os.path.getsize(file_name) * COLLADA_MEMORY_FACTOR
+
+
+def ParseArray(text, dtype):
+    '''
+    Parses whitespace separated numbers all at once.
+    '''
+    if text is None or text.isspace():
+        return np.array([], dtype=dtype)
+    return np.fromstring(text, dtype=dtype, sep=' ')
+
+
+def FreeElement(element):
+    '''
+    Drops the text and children of an already read element,
+    while the objects loaded from it may still hold its subelements.
+    '''
+    for subelement in element.iter():
+        subelement.text = None
+    element.clear()
+
+
+def IndexDocument(mesh):
+    '''
+    Builds the ColladaIndex of a document.
+
+    - Map geometries to their skin controllers
+    - Walk the scenes xml once, mapping nodes by their ids
+      and controllers to the nodes instancing them
+    - Read the <skeleton> of every instanced controller
+    - Collect the materials library ids
+    '''
+    index = ColladaIndex()
+    tag = mesh.tag
+
+    for controller in mesh.controllers:
+        if isinstance(controller, (collada.controller.Skin, StreamSkin)):
+            index.skins.setdefault(controller.geometry.id, controller)
+
+    # Depth-first, in document order, so that the first
+    # match wins just like with a recursive search.
+    scenes = mesh.xmlnode.findall(f'{tag("library_visual_scenes")}/{tag("visual_scene")}')
+    index.scenes = len(scenes)
+    for scene in scenes:
+        stack = list(reversed(scene.findall(tag('node'))))
+        while stack:
+            node = stack.pop()
+            node_id = node.get('id')
+            if node_id is not None:
+                index.nodes.setdefault(node_id, node)
+
+            for instance in node.findall(tag('instance_controller')):
+                controller_id = instance.get('url', '').replace('#', '')
+                if controller_id not in index.controller_nodes:
+                    index.controller_nodes[controller_id] = node
+                    index.skeletons[controller_id] = ReadSkeleton(instance)
+
+            stack.extend(reversed(node.findall(tag('node'))))
+
+    for material in mesh.xmlnode.findall(f'{tag("library_materials")}/{tag("material")}'):
+        index.materials.append(material.get('id'))
+
+    return index
+
+
+def ReadSkeleton(instance_controller):
+    '''
+    Reads the <skeleton> xml node data manually, as PyCollada
+    refuses to read that single node.
+    <skeleton> points to the node containing the, as the name
+    sugests, armature/skeleton.
+    Refer to https://github.com/pycollada/pycollada/issues/129
+
+    Args:
+        instance_controller (xml.etree.ElementTree.Element): The <instance_controller> xml node.
+
+    Returns:
+        str or None: Id of the armature starting node.
+    '''
+    for xml_node in instance_controller.iter():
+        if 'skeleton' in xml_node.tag and xml_node.text:
+            return xml_node.text.strip().replace('#','')
+    return None
 
 
-def ExtractMaterials(material_tag, mesh):
+def LoadArmatureNode(mesh, xml_node, transforms=True):
+    '''
+    Loads a <node> xml node and its <node> children into PyCollada nodes,
+    without the need for the whole scenes library to be loaded.
+    Instanced geometries, controllers and such are left out, as the armature
+    consists of nodes only.
+
+    Args:
+        mesh (ColladaDocument): Document containing the node.
+        xml_node (xml.etree.ElementTree.Element): The <node> xml node.
+        transforms (bool, optional): Whether to load the node transforms. Defaults to True.
+
+    Returns:
+        collada.scene.Node: The loaded node.
+    '''
+    children = []
+    node_transforms = []
+    for child in xml_node:
+        if child.tag == mesh.tag('node'):
+            children.append(LoadArmatureNode(mesh, child, transforms))
+
+        elif transforms and child.tag in [mesh.tag(name) for name in TRANSFORM_TAGS]:
+            node_transforms.append(collada.scene.loadNode(mesh, child, {}))
+
+    return collada.scene.Node(xml_node.get('id'), children, node_transforms,
+                              xmlnode=xml_node, name=xml_node.get('name'))
+
+
+def ExtractMaterials(material_tag, index):
     '''
     Materials Library Section
 
     - Extract existing materials info
     '''
-    logger.info('Found %s materials, extracting...', len(mesh.materials))
     materials_list = []
-    for material in mesh.materials:
-        texture = material.id
+    for texture in index.materials:
         materials_list.append(Material(texture=texture, tag=material_tag))
     return MaterialArray(materials_list)
 
 
-def ExtractGeometries(geometry, material_tag):
+def ExtractGeometries(geometry, material_tag, crease_angle=None):
     '''
     Geometry Library Section
     
     - Extract vertices, indices and normals
-    - Fix normals if necessary
-    - Generalize indices
+    - Triangulate polygons
+    - Generate normals if missing
+    - Weld face corners into shared indices
     - Extract connected material name
     - Initiate primitives
+
+    Also returns the source vertex of every welded vertex
+    of every primitive, used to look up the skin data.
     '''
     primitives_list = []
-    old_vertex_indices = []
+    vertex_sources = []
 
     for collada_primitive in geometry.primitives:
-        if collada_primitive.normal is None or len(collada_primitive.normal) != len(collada_primitive.vertex):
-
-            if type(collada_primitive) is collada.lineset.LineSet or type(collada_primitive) is collada.polylist.Polylist:
-                logger.warning('Cannot generate normals for LineSet/PolyList, this set of primitives will be skipped.')
-                continue
-
-            logger.debug('Generating normals...')
-            collada_primitive.generateNormals()
-
-        # Initalize temporary primitives
-        v  = collada_primitive.vertex.tolist()
-        vn = collada_primitive.normal.tolist()
-
-        vt_list = []
-        for texcoords in collada_primitive.texcoordset:
-            vt_list.append(texcoords.tolist())
-
-        # Collapse indices subgeometries
-        indices_v  = ListFlatten(collada_primitive.vertex_index.tolist())
-        indices_vn = ListFlatten(collada_primitive.normal_index.tolist())
-
-        indices_vt_list = []
-        for indices in collada_primitive.texcoord_indexset:
-            indices_vt_list.append(ListFlatten(indices.tolist()))
-
-        # Save old vertex indices to use when reordering bone weight/index data
-        old_vertex_indices.append(indices_v)
-
-        # Select the best candidate for general indices
-        indices = sorted([indices_v,indices_vn]+indices_vt_list, key=len, reverse=True)[0]
+        if collada_primitive.vertex_index is None:
+            logger.debug('Skipping empty primitive.')
+            continue
 
-        logger.debug('Generalizing indices...')
-        v = Vertices(ListFlatten(PrimitiveReorder(v, indices_v, indices)))
-        vn = Normals(ListFlatten(PrimitiveReorder(vn, indices_vn, indices)))
-        for i, vt in enumerate(vt_list):
-            vt_list[i] = Texcoords(ListFlatten(PrimitiveReorder(vt, indices_vt_list[i], indices)))
-        vt_list = TexcoordsArray(vt_list)
-
-        # Determine the primitive mode
-        if type(collada_primitive) is collada.lineset.LineSet:
+        # Determine the primitive mode, and which corners
+        # of the primitive make up its faces, in order
+        if isinstance(collada_primitive, collada.lineset.LineSet):
             mode = 'LINES'
             logger.warning('Experimental geometry mode: %s, the results may be faulty.', type(collada_primitive))
+            faces = np.arange(collada_primitive.vertex_index.size).reshape(-1, 2)
 
-        elif type(collada_primitive) is collada.triangleset.TriangleSet:
+        elif isinstance(collada_primitive, collada.triangleset.TriangleSet):
             mode = 'TRIANGLES'
             logger.debug('Geometry mode: %s', type(collada_primitive))
-                
-        elif type(collada_primitive) is collada.polylist.Polygon:
-            mode = 'POLYGON'
-            logger.warning('Experimental geometry mode: %s, the results may be faulty.', type(collada_primitive))
-
-                
-        elif type(collada_primitive) is collada.polylist.Polylist:
-            mode = 'POLYGON'
-            logger.warning('Experimental geometry mode: %s, the results may be faulty.', type(collada_primitive))
+            faces = np.arange(collada_primitive.vertex_index.size).reshape(-1, 3)
 
+        # Includes Polygons
+        elif isinstance(collada_primitive, collada.polylist.Polylist):
+            mode = 'TRIANGLES'
+            logger.debug('Geometry mode: %s, triangulating...', type(collada_primitive))
+            faces = TriangulatePolygons(collada_primitive.vcounts)
 
         else:
             raise Exception(f'Unrecognized geometry mode! '
                             f'Found: {type(collada_primitive)}')
 
+        vertex_index = collada_primitive.vertex_index.ravel()[faces]
+        if collada_primitive.normal is not None:
+            normals = collada_primitive.normal
+            normal_index = collada_primitive.normal_index.ravel()[faces]
+
+        elif mode == 'LINES':
+            logger.debug('Lines have no faces to generate normals from, leaving them empty.')
+            normals = np.zeros((1, 3), dtype=np.float32)
+            normal_index = np.zeros_like(faces)
+
+        else:
+            logger.debug('Generating normals...')
+            normals, normal_index = GenerateNormals(collada_primitive.vertex, vertex_index, crease_angle)
+
+        # Stack the v/vn/vt... indices of every face corner into rows
+        corners = np.stack([vertex_index.ravel(), normal_index.ravel()]
+                           + [indices.ravel()[faces].ravel() for indices in collada_primitive.texcoord_indexset], axis=1)
+
+        logger.debug('Welding vertices...')
+        corners, indices = DeduplicateCorners(corners)
+
+        # Gather the attributes of every welded vertex
+        v = Vertices(collada_primitive.vertex[corners[:, 0]].ravel())
+        vn = Normals(normals[corners[:, 1]].ravel())
+        vt_list = []
+        for i, vt in enumerate(collada_primitive.texcoordset):
+            vt_list.append(Texcoords(vt[corners[:, 2 + i]].ravel()))
+        vt_list = TexcoordsArray(vt_list)
+
+        vertex_sources.append(corners[:, 0])
+
         # Extract connected material
         texture = collada_primitive.material
 
@@ -195,10 +812,74 @@ def ExtractGeometries(geometry, material_tag):
     if not primitives_list:
         raise Exception('No valid primitives found in the model')
 
-    return PrimitiveWrapper(primitives_list), old_vertex_indices
+    return PrimitiveWrapper(primitives_list), vertex_sources
 
 
-def ExtractControllers(mesh, geometry, primitives, old_vertex_indices):
+def GenerateNormals(vertices, triangles, crease_angle=None):
+    """
+    Generates area weighted smooth normals of triangles. If a crease angle
+    is given, faces meeting at a sharper angle are not smoothed together,
+    leaving a hard edge between them.
+
+    Args:
+        vertices (numpy.ndarray): (V, 3) vertex positions.
+        triangles (numpy.ndarray): (T, 3) vertex indices of every triangle.
+        crease_angle (float, optional): Crease angle in degrees. Defaults to None (smooth everything).
+
+    Returns:
+        tuple: (N, 3) array of normals and (T, 3) normal indices of every triangle.
+    """
+    positions = np.asarray(vertices, dtype=np.float64)[triangles]
+
+    # Length of the cross product is twice the area of the triangle,
+    # so summing the raw face normals weighs them by area
+    face_normals = np.cross(positions[:, 1] - positions[:, 0], positions[:, 2] - positions[:, 0])
+    corner_vertices = triangles.ravel()
+    corner_faces = np.repeat(np.arange(len(triangles)), 3)
+
+    if crease_angle is None:
+        normals = np.empty((len(vertices), 3))
+        for axis in range(3):
+            normals[:, axis] = np.bincount(corner_vertices, weights=face_normals[corner_faces, axis],
+                                           minlength=len(vertices))
+        return NormalizeRows(normals).astype(np.float32), triangles
+
+    # Pair every corner with all corners sharing its vertex, grouping them by vertex
+    order = np.argsort(corner_vertices, kind='stable')
+    counts = np.bincount(corner_vertices, minlength=len(vertices))
+    degrees = counts[corner_vertices[order]]
+    group_starts = (np.cumsum(counts) - counts)[corner_vertices[order]]
+
+    corners = np.repeat(np.arange(order.size), degrees)
+    partners = np.repeat(group_starts, degrees) + np.arange(degrees.sum()) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    corners = order[corners]
+    partners = order[partners]
+
+    # Only faces within the crease angle of each other are smoothed together
+    unit_normals = NormalizeRows(face_normals)
+    cosines = np.einsum('ij,ij->i', unit_normals[corner_faces[corners]], unit_normals[corner_faces[partners]])
+    smoothed = (cosines >= math.cos(math.radians(crease_angle))) | (corners == partners)
+
+    corner_normals = np.empty((corner_vertices.size, 3))
+    for axis in range(3):
+        corner_normals[:, axis] = np.bincount(corners[smoothed], weights=face_normals[corner_faces[partners[smoothed]], axis],
+                                              minlength=corner_vertices.size)
+
+    # Corners smoothed with the same faces end up with the same normals
+    normals, normal_index = np.unique(NormalizeRows(corner_normals).astype(np.float32), axis=0, return_inverse=True)
+    return normals, normal_index.reshape(triangles.shape)
+
+
+def NormalizeRows(vectors):
+    """
+    Scales every row to unit length, leaving zero length rows as they are.
+    """
+    lengths = np.linalg.norm(vectors, axis=1)
+    lengths[lengths == 0] = 1
+    return vectors / lengths[:, np.newaxis]
+
+
+def ExtractControllers(index, geometry, primitives, vertex_sources):
     '''
     Controllers Library Section
     - Extract bone indices, weights and names
@@ -208,150 +889,93 @@ def ExtractControllers(mesh, geometry, primitives, old_vertex_indices):
       hierarchy later on.
     '''
 
-    bones = []
-    controller = None
+    # Look for the controller related to the current geometry
+    controller = index.skins.get(geometry.id)
+    if not controller:
+        return None
+
+    logger.info(f'Controller found! Processing: "%s"...', controller.id)
 
-    primitive_bone_indices = []
-    primitive_bone_weights = []
-    primitive_vertex_indices = []
+    # Extract bone names, stored in a fairly weird way so has to be retrieved like that
+    bones = controller.weight_joints.data.ravel().tolist()
+    primitive_bone_indices, primitive_bone_weights = ExtractBoneInfluences(controller)
 
-    # Look for controllers related to the current geometry
-    for controller in mesh.controllers:
-        if isinstance(controller, collada.controller.Skin) and \
-                controller.geometry.id == geometry.id:
-            logger.info(f'Controller found! Processing: "%s"...', controller.id)
+    # Welded vertices take the skin data of their source vertices
+    for i, primitive in enumerate(primitives):
+        sources = vertex_sources[i]
+        if sources.size and sources.max() < len(primitive_bone_indices):
+            bone_indices = primitive_bone_indices[sources].ravel()
+            bone_weights = primitive_bone_weights[sources].ravel()
+            primitives[i] = PrimitiveAddSkin(primitive=primitive, bones=Bones(bones), vertex_attribs=VertexAttribArray([BoneIndices(bone_indices), BoneWeights(bone_weights)]))
 
-            # Extract bone names, stored in a fairly weird way so has to be retrieved like that
-            bones = ListFlatten(controller.weight_joints.data.tolist())
+    return controller
 
-            bone_weight_warn = False
-            for bone_vertex in controller.index:
-                bone_indices = []
-                bone_weights = []
 
-                # Extract bone weights and indices for single vertex
-                for bone_index, bone_weight_index in bone_vertex:
-                    bone_indices.append(float(bone_index))
+def ExtractBoneInfluences(controller, max_influences=4):
+    """
+    Extracts bone indices and weights of every vertex affected by the controller.
+    Influences of all vertices are padded into dense arrays, only max_influences
+    biggest weights are kept for every vertex and the trimmed weights get normalized.
 
-                    for weight in controller.weights.data[bone_weight_index]:
-                        bone_weights.append(float(weight))
+    Args:
+        controller (collada.controller.Skin): Controller to extract the influences from.
+        max_influences (int, optional): Bone slots per vertex. Clyde only handles 4.
 
-                    primitive_vertex_indices.append(bone_weight_index)
+    Returns:
+        tuple: (V, max_influences) arrays of bone indices and bone weights.
+    """
+    vcounts = np.asarray(controller.vcounts, dtype=np.intp)
+    vertices_num = vcounts.size
+    influences_num = int(vcounts.sum())
 
-                if len(bone_weights) > 4:
-                    # Remove len(bone_vertex)-4 smallest bone weights
-                    for weight in sorted(bone_weights)[:len(bone_vertex)-4]:
-                        index = bone_weights.index(weight)
-                        del bone_weights[index]
-                        del bone_indices[index]
+    index = np.asarray(controller.vertex_weight_index).reshape(-1, controller.nindices)[:influences_num]
+    joints = index[:, controller.offsets[0]].astype(np.float64)
+    weights = controller.weights.data.ravel()[index[:, controller.offsets[1]].astype(np.intp)].astype(np.float64)
 
-                    # Bone weights need to be normalized, so that they add up to 1
-                    bone_weights = WeightNormalize(bone_weights)
+    # Scatter the influences into (V, width) matrices,
+    # unused slots get -inf weights so that they always rank the lowest
+    width = max(int(vcounts.max(initial=0)), max_influences)
+    rows = np.repeat(np.arange(vertices_num), vcounts)
+    columns = np.arange(influences_num) - np.repeat(np.cumsum(vcounts) - vcounts, vcounts)
 
-                    if not bone_weight_warn:
-                        bone_weight_warn = True
-                        logger.warning('Unable to handle more than 4 bone '
-                                        'weights per vertex. Will cut the extra ones, '
-                                        'but the armature may not work properly. '
-                                        'Refer to the documentation.')
+    dense_joints = np.zeros((vertices_num, width))
+    dense_joints[rows, columns] = joints
+    dense_weights = np.full((vertices_num, width), -np.inf)
+    dense_weights[rows, columns] = weights
 
-                # Fill out the remaining bone slots with 0.0
-                zeros_num = 4 - len(bone_weights)
-                for _ in range(zeros_num):
-                    bone_indices.append(0.0)
-                    bone_weights.append(0.0)
+    trimmed = vcounts > max_influences
+    if trimmed.any():
+        logger.warning('Unable to handle more than 4 bone '
+                       'weights per vertex. Will cut the extra ones, '
+                       'but the armature may not work properly. '
+                       'Refer to the documentation.')
 
-                primitive_bone_indices.append(bone_indices)
-                primitive_bone_weights.append(bone_weights)
+    # Drop the smallest weights of every vertex, keeping the rest in their original order.
+    # A stable sort makes the earliest of equal weights go first, like it always did.
+    ranking = np.argsort(dense_weights, axis=1, kind='stable')
+    kept = np.sort(ranking[:, width - max_influences:], axis=1)
 
-            # No need to look for more controllers
-            break
+    bone_indices = np.take_along_axis(dense_joints, kept, axis=1)
+    bone_weights = np.take_along_axis(dense_weights, kept, axis=1)
 
-    if not controller:
-        return None
+    # Fill out the remaining bone slots with 0.0
+    bone_weights[np.isneginf(bone_weights)] = 0.0
 
-    for i, primitive in enumerate(primitives):
-        if len(primitive.vertices) == len(primitive_bone_indices) \
-                and len(primitive.vertices) == len(primitive_bone_weights):
-            old_indices = old_vertex_indices[i]
-            new_indices = primitive.indices.data
-            primitive_bone_indices = ListFlatten(PrimitiveReorder(primitive_bone_indices, old_indices, new_indices))
-            primitive_bone_weights = ListFlatten(PrimitiveReorder(primitive_bone_weights, old_indices, new_indices))
-            primitives[i] = PrimitiveAddSkin(primitive=primitive, bones=Bones(bones), vertex_attribs=VertexAttribArray([BoneIndices(primitive_bone_indices), BoneWeights(primitive_bone_weights)]))
+    # Bone weights need to be normalized, so that they add up to 1
+    bone_weights[trimmed] = WeightNormalize(bone_weights[trimmed])
 
-    return controller
+    return bone_indices, bone_weights
 
 
-def ExtractArmature(mesh, primitives, controller):
+def ExtractArmature(mesh, index, primitives, controller, transforms=True):
     '''
     Scenes Library Section
 
     - Extract ArmatureNode Hierarchy
     - Fix Bones if possible
+    - Bones transforms are left empty if transforms is False
     '''
 
-    # These functions are a necessity since reading <skeleton>
-    # requires manual xml read relying on strings, as
-    # PyCollada refuses to read that single node
-    # <skeleton> points to the node containing
-    # the, as the name sugests, armature/skeleton.
-    # Refer to https://github.com/pycollada/pycollada/issues/129        
-    def ArmatureFindNodeByController(main_node, controller):
-        """
-        Recursively searches for an armature node connected to specified controller in a Collada scene graph.
-
-        Args:
-            main_node (collada.scene.Node): The main collada node to start the search from.
-            controller (collada.controller.Skin): Current geometry controller.
-
-        Returns:
-            None (Implied return of collada.scene.Node or None (if not found) in located_armature_node_ctrl nonlocal var)
-        """
-
-        nonlocal collada_controller_node
-        if not collada_controller_node:
-            for child in main_node.children:
-
-                # Look for nodes with ControllerNode as a child and 
-                # check if it's the current geometry controller
-                if type(child) is collada.scene.ControllerNode \
-                    and child.controller == controller:
-                    collada_controller_node = main_node
-
-                # Apply recursion if child is an armature node
-                if type(child) is collada.scene.Node:
-                    ArmatureFindNodeByController(child, controller)
-
-
-    def ArmatureFindNodeByName(main_node, armature_node_name):
-        """
-        Recursively searches for an armature node with a specified name in a Collada scene graph.
-
-        Args:
-            main_node (collada.scene.Node): The main collada node to start the search from.
-            armature_node_name (str, optional): The name of the armature node to search for.
-
-        Returns:
-            None (Implied return of collada.scene.Node or None (if not found) in collada_main_node nonlocal var)
-        """
-
-        nonlocal collada_main_node
-
-        # Void all further recursions from this node
-        # if found the correct armature node
-        if armature_node_name and main_node.id == armature_node_name:
-            collada_main_node = main_node
-
-        if not collada_main_node:
-
-            # Iterate over all children
-            for child in main_node.children:
-
-                # Apply recursion if child is an armature node
-                if type(child) is collada.scene.Node:
-                    ArmatureFindNodeByName(child, armature_node_name)
-
-
     def ColladaNodeToObj(collada_node, collada_path=[], obj_path=[]):
         """
         Converts a Collada armature node to a unified ArmatureNode object representation.
@@ -483,40 +1107,22 @@ def ExtractArmature(mesh, primitives, controller):
             obj_path.pop(-1)
 
 
-    # Requires two separate loops
-    # First, find the parent node of <skeleton> xml node
-    # Second, find the aforementioned
-    # armature starting node by its name.
+    # Find the node instancing the controller, then
+    # the armature starting node pointed by its <skeleton>.
     logger.info('Searching for armature starting node...')
 
-    collada_controller_node = None
-    for scene in mesh.scenes:
-        for scene_node in scene.nodes:
-            ArmatureFindNodeByController(scene_node, controller)
-            if collada_controller_node:
-                break
-
-    # Read the <skeleton> xml node data manually.
-    collada_main_node_name = None
-    for xml_node in collada_controller_node.xmlnode.iter():
-        if 'skeleton' in xml_node.tag:
-            collada_main_node_name = xml_node.text.replace('#','')
-            break
-
-    collada_main_node = None
-    if collada_main_node_name:
-        for scene in mesh.scenes:
-            for scene_node in scene.nodes:
-                ArmatureFindNodeByName(scene_node, collada_main_node_name)
-                if collada_main_node:
-                    break
-
-    if not collada_controller_node or not collada_main_node:
+    collada_controller_node = index.controller_nodes.get(controller.id)
+    collada_main_node_name = index.skeletons.get(controller.id)
+    collada_main_node = index.nodes.get(collada_main_node_name) if collada_main_node_name else None
+
+    if collada_controller_node is None or collada_main_node is None:
         logger.error('Unable to locate the armature '
                      'starting joint node, file may be corrupted. '
                      'Armature will not be imported.')
         return None
 
+    collada_main_node = LoadArmatureNode(mesh, collada_main_node, transforms)
+
     # root_xml_node, bones_list and unnamed_bone_num
     # need to be accessible outside and inside
     # the recursions, as the root_xml_node is practically
@@ -545,20 +1151,20 @@ def ExtractArmature(mesh, primitives, controller):
 # Thanks the algorithm Xan
 def WeightNormalize(weights):
     """
-    Normalize a list of weights. (Make them add up to 1)
+    Normalize rows of weights. (Make them add up to 1)
 
     Parameters:
-    weights (list): A list of weights.
+    weights (numpy.ndarray): (N, k) array of weights.
 
     Returns:
-    list: A list of normalized weights.
+    numpy.ndarray: Array of normalized weights.
     """
-    output_weights = []
-
-    for weight in weights:
-        output_weights.append(weight / sum(weights))
+    # Summed column by column to add up exactly like the builtin sum() did
+    weights_sum = np.zeros(len(weights))
+    for column in weights.T:
+        weights_sum += column
 
-    return output_weights
+    return weights / weights_sum[:, np.newaxis]
 
 
 def GetPrimitiveIndexByIndex(primitive_wrapper: PrimitiveWrapper, index):
@@ -581,36 +1187,3 @@ def GetPrimitiveIndexByIndex(primitive_wrapper: PrimitiveWrapper, index):
         offset += primitive.indices_end
         primitive_index += 1
     return None
-
-
-def PrimitiveReorder(prim_list, old_indices, new_indices):
-    """
-    Reorders the primitive data based on the given old and new indices.
-
-    Args:
-        prim_list (list): The list of primitive data to be reordered.
-        old_indices (list): The list of old indices.
-        new_indices (list): The list of new indices.
-
-    Returns:
-        list: The reordered primitive data.
-    """
-
-    # Don't reorder if indices are the same
-    if old_indices == new_indices:
-        return prim_list
-
-    # Transitional indices used for reordering data
-    indices_trans = {}
-    for i in range(min(len(new_indices), len(old_indices))):
-        indices_trans[old_indices[i]] = new_indices[i]
-
-    # Initalize output data with empty vertices array
-    data = []
-    for _ in range(max(max(new_indices+old_indices), len(prim_list))):  # What is actually wrong with you
-        data.append([0.0] * len(prim_list[0]))
-
-    # Reorder data in separate lists
-    for key_old, key_new in indices_trans.items():  # TODO: uwzględnij pomijane primitives
-        data[key_new] = prim_list[key_old]
-    return data
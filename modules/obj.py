@@ -10,10 +10,18 @@
 # https://github.com/Puzovoz/Bootshuze  #
 #########################################
 
-import gc
+import os
+import re
+import mmap
+import warnings
+import numpy as np
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 
 from schema.model           import *
 from components.logger      import GetLogger
+from components.memory      import GetMemoryGovernor
+from components.mesh        import DeduplicateCorners, TriangulatePolygons
 
 logger = GetLogger()
 
@@ -23,75 +31,369 @@ module_data = {
     'Mesh'          : True,
     'Armature'      : False,
     'Animations'    : False,
-    'Multimesh'     : False,
-    'Multimaterial' : False,
+    'Multimesh'     : True,
+    'Multimaterial' : True,
 }
 
+# Input files larger than that (in bytes) are read
+# through a memory map instead of line by line.
+MMAP_THRESHOLD = 256 * 1024 * 1024
 
-def Extract(file_name):
+# Rough memory use of reading a file line by line, per byte of the file.
+# Smaller files are read through a memory map too, if that would not fit the memory budget.
+STREAMED_MEMORY_FACTOR = 16
+
+# Matches either a run of consecutive v/vt/vn/f records of the same kind,
+# capped so that a single block never gets too large to copy,
+# or a single o/g/usemtl record. Records may be indented.
+MMAP_BLOCK_LINES = 65536
+MMAP_RECORDS = re.compile(rb'^[ \t]*(?:(vt|vn|v|f)[ \t][^\n]*(?:\n[ \t]*\1[ \t][^\n]*){0,%d}'
+                          rb'|(o|g|usemtl)[ \t]([^\n]*))' % (MMAP_BLOCK_LINES - 1), re.M)
+MMAP_FACE_TABLE = bytes.maketrans(b'/', b' ')
+
+# Number of values used from every v/vt/vn record
+ATTRIBUTE_SIZES = {b'v': 3, b'vt': 2, b'vn': 3}
+
+# Texture used by faces without any material assigned
+DEFAULT_TEXTURE = 'texture.png'
+
+
+@dataclass
+class WavefrontGroup:
+    '''
+    Faces of a single o/g/usemtl group, each group becomes a separate Primitive.
+    - self.corner_indices: (N, 3) array of v/vt/vn indices of every unique face corner,
+      or of every face corner if the group was not deduplicated yet.
+    - self.indices: Indices of face corners within self.corner_indices,
+      None if the group was not deduplicated yet.
+    - self.face_sizes: Number of corners of every face.
+    - self.corners: Maps "v/vt/vn" face corners to their indices while reading.
+    '''
+    name: str
+    material: str
+    corner_indices: list = field(default_factory=list)
+    indices: list = field(default_factory=list)
+    face_sizes: list = field(default_factory=list)
+    corners: dict = field(default_factory=dict)
+
+
+def Extract(file_name, settings=None):
     logger.info('Reading input model file.')
+    tag = 'default'
+    geometries = []
+
+    file_size = os.path.getsize(file_name)
+    if file_size > MMAP_THRESHOLD:
+        logger.debug('Large input file, reading through a memory map.')
+        v, vt, vn, groups = ReadMapped(file_name)
+    elif not GetMemoryGovernor().fits(file_size * STREAMED_MEMORY_FACTOR):
+        logger.info('Memory budget is tight, reading through a memory map.')
+        v, vt, vn, groups = ReadMapped(file_name)
+    else:
+        v, vt, vn, groups = ReadStreamed(file_name)
+
+    if len(vt) == 0:
+        raise Exception('Input model lacks UV mapping. '
+                        'Model cannot be correctly created.')
+
+    groups = [group for group in groups if group.face_sizes]
+    if not groups:
+        raise Exception('Missing model geometry')
+    logger.info('Found %s groups, calculating vertices...', len(groups))
+
+    # Groups don't depend on each other, process them concurrently.
+    # NumPy releases the GIL for the heavy lifting.
+    workers = min(len(groups), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        primitives = list(executor.map(lambda group: GroupToPrimitive(group, v, vt, vn, tag), groups))
+
+    # A single material per texture, in order of appearance
+    materials = []
+    for texture in dict.fromkeys(primitive.texture for primitive in primitives):
+        materials.append(Material(tag=tag, texture=texture))
+
+    del groups
+    del v, vn, vt
+    GetMemoryGovernor().checkpoint()
+
+    model = Model(primitives=PrimitiveWrapper(primitives), 
+                  materials=MaterialArray(entry_list=materials))
+
+    geometries.append(model)
+    return geometries
+
+
+def GroupToPrimitive(group, v, vt, vn, tag):
+    """
+    Gathers the vertex data of a single group and creates its Primitive.
+
+    Args:
+        group (WavefrontGroup): The group to convert.
+        v (numpy.ndarray): Positions declared in the input file.
+        vt (numpy.ndarray): Texture coordinates declared in the input file.
+        vn (numpy.ndarray): Normals declared in the input file.
+        tag (str): Material tag.
+
+    Returns:
+        Primitive: The primitive made of the group faces.
+    """
+    corner_indices = group.corner_indices
+    indices = group.indices
+    if indices is None:
+        corner_indices, indices = DeduplicateCorners(corner_indices)
+
+    # Wavefront indices start at 1
+    corner_indices = corner_indices - 1
+
+    indices, mode = FacesToIndices(group, indices)
+    logger.debug('Group "%s" geometry mode: %s', group.name, mode)
+
+    # Generate vertices based on the unique face corners,
+    # in the order of their output indices
+    vertices  = v[corner_indices[:, 0]]
+    texcoords = vt[corner_indices[:, 1]]
+    normals   = vn[corner_indices[:, 2]]
+
+    return Primitive(vertices=Vertices(vertices.ravel()), normals=Normals(normals.ravel()),
+                     texcoords=TexcoordsArray([Texcoords(texcoords.ravel())]),
+                     indices=Indices(indices), mode=mode, tag=tag, texture=group.material)
+
+
+def FacesToIndices(group, indices):
+    """
+    Determines the geometry mode of a group. Groups mixing faces
+    of different sizes get their polygons fan-triangulated.
+
+    Args:
+        group (WavefrontGroup): The group the indices belong to.
+        indices (numpy.ndarray): Indices of all face corners of the group.
+
+    Returns:
+        tuple: Output indices and geometry mode.
+    """
+    sizes = np.asarray(group.face_sizes, dtype=np.intp)
+    first_size = int(sizes[0])
+    if FaceMode(first_size) and np.all(sizes == first_size):
+        return indices, FaceMode(first_size)
+
+    logger.warning('Group "%s" mixes faces of different sizes or contains '
+                   'polygons, they will be triangulated.', group.name)
+    if np.any(sizes < 3):
+        logger.warning('Lines in group "%s" will be skipped.', group.name)
+
+    return indices[TriangulatePolygons(sizes)].ravel(), 'TRIANGLES'
+
+
+def FaceMode(indices_count):
+    """
+    Returns the geometry mode of a face with the given number of corners.
+    """
+    if indices_count == 2: return 'LINES'
+    if indices_count == 3: return 'TRIANGLES'
+    if indices_count == 4: return 'QUADS'
+    return None
+
+
+def ReadStreamed(file_name):
+    """
+    Reads the input file line by line.
+
+    Args:
+        file_name (str): Path to the Wavefront file.
+
+    Returns:
+        tuple: v, vt, vn float arrays and a list of WavefrontGroup
+               with deduplicated face corners.
+    """
+    # Attribute values as declared in the input file,
+    # converted to float arrays in bulk once the file is read
+    v  = []
+    vt = []
+    vn = []
+
+    group = WavefrontGroup(name='default', material=DEFAULT_TEXTURE)
+    groups = [group]
+
     with open(file_name, 'r') as file:
-        tag = 'default'
-        texture = 'texture.png'
-        faces      = []
-        indices    = []
-        vertices   = []
-        geometries = []
-        lines = file.readlines()
-
-        logger.info('Calculating indices...')
-        for line in lines:
-            # Store faces that determine the numbers for indices
-            if line[0] == 'f':
-                indices_count = len(line.split()[1:])
-                if indices_count == 2: mode = 'LINES'
-                if indices_count == 3: mode = 'TRIANGLES'
-                if indices_count == 4: mode = 'QUADS'
-
-                for face in line.split()[1:]:
-                    if face not in faces: faces.append(face.replace('\n', ''))
-                    indices.append(faces.index(face))
-
-        logger.info('Geometry mode: %s', mode)
-
-        vt = list(filter(lambda x: x[:2] == 'vt', lines))
-        vn = list(filter(lambda x: x[:2] == 'vn', lines))
-        v  = list(filter(lambda x: x[:2] == 'v ', lines))
-
-        if len(vt) == 0:
-            raise Exception('Input model lacks UV mapping. '
-                            'Model cannot be correctly created.')
-
-        logger.info('Calculating vertices...')
-
-        # Generate vertices list based on indices from input file
-        vertices = []
-        texcoords = []
-        normals = []
-        for face in faces:
-            face_indices = face.split('/')
-
-            # Texture coordinates, UV
-            texcoords.extend([float(val) for val in vt[int(face_indices[1])-1].split()[1:]])
-
-            # Face normals
-            normals.extend([float(val) for val in vn[int(face_indices[2])-1].split()[1:]])
-
-            # Position coordinates, XYZ
-            vertices.extend([float(val) for val in v[int(face_indices[0])-1].split()[1:]])
-
-        material = Material(tag=tag, texture=texture)
-        primitive = Primitive(vertices=Vertices(vertices), normals=Normals(normals), texcoords=TexcoordsArray([Texcoords(texcoords)]),
-                              indices=Indices(indices), mode=mode, tag=tag, texture=texture)
-
-        model = Model(primitives=PrimitiveWrapper([primitive]), 
-                      materials=MaterialArray(entry_list=[material]))
-
-        del faces
-        del lines
-        del v, vn, vt
-        del indices
-        del vertices
-        gc.collect()
-        geometries.append(model)
-        return geometries
\ No newline at end of file
+        for line in file:
+            values = line.split()
+            if not values:
+                continue
+            keyword = values[0]
+
+            if keyword == 'v':
+                v.extend(values[1:4])
+
+            elif keyword == 'vt':
+                vt.extend(values[1:3])
+
+            elif keyword == 'vn':
+                vn.extend(values[1:4])
+
+            # Store faces that determine the numbers for indices.
+            # Maps every unique "v/vt/vn" face corner to its output index,
+            # so that repeated corners share a single vertex.
+            elif keyword == 'f':
+                group.face_sizes.append(len(values) - 1)
+                for corner in values[1:]:
+                    index = group.corners.get(corner)
+                    if index is None:
+                        index = len(group.corners)
+                        group.corners[corner] = index
+                        group.corner_indices.extend(corner.split('/'))
+                    group.indices.append(index)
+
+            # Records without a name are skipped, as by ReadMapped
+            elif keyword in ('o', 'g', 'usemtl') and len(values) > 1:
+                name = ' '.join(values[1:])
+                if keyword == 'usemtl':
+                    group = WavefrontGroup(name=group.name, material=name)
+                else:
+                    group = WavefrontGroup(name=name, material=group.material)
+                groups.append(group)
+
+    # Convert the whole attribute blocks at once
+    v  = np.array(v, dtype=np.float64).reshape(-1, 3)
+    vt = np.array(vt, dtype=np.float64).reshape(-1, 2)
+    vn = np.array(vn, dtype=np.float64).reshape(-1, 3)
+
+    for group in groups:
+        group.corner_indices = np.array(group.corner_indices, dtype=np.intp).reshape(-1, 3)
+        group.indices = np.array(group.indices, dtype=np.intp)
+        group.corners = None
+
+    return v, vt, vn, groups
+
+
+def ReadMapped(file_name):
+    """
+    Reads the input file through a memory map. Runs of records of the same kind
+    are located directly in the mapped bytes and parsed block by block,
+    no per-line string objects are created.
+
+    Args:
+        file_name (str): Path to the Wavefront file.
+
+    Returns:
+        tuple: v, vt, vn float arrays and a list of WavefrontGroup
+               with face corners yet to be deduplicated.
+    """
+    blocks = {b'v': [], b'vt': [], b'vn': []}
+
+    group = WavefrontGroup(name='default', material=DEFAULT_TEXTURE)
+    groups = [group]
+
+    with open(file_name, 'rb') as file, \
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+
+        for record in MMAP_RECORDS.finditer(mapped):
+            keyword = record.group(1)
+
+            if keyword is None:
+                name = ' '.join(record.group(3).decode(errors='replace').split())
+                if not name:
+                    continue
+                if record.group(2) == b'usemtl':
+                    group = WavefrontGroup(name=group.name, material=name)
+                else:
+                    group = WavefrontGroup(name=name, material=group.material)
+                groups.append(group)
+                continue
+
+            block = mapped[record.start():record.end()]
+            if keyword == b'f':
+                corners, sizes = ParseFaceBlock(block)
+                group.corner_indices.append(corners)
+                group.face_sizes.extend(sizes.tolist())
+            else:
+                blocks[keyword].append(ParseAttributeBlock(block, keyword, ATTRIBUTE_SIZES[keyword]))
+            del block
+
+    v  = ConcatenateBlocks(blocks[b'v'], ATTRIBUTE_SIZES[b'v'])
+    vt = ConcatenateBlocks(blocks[b'vt'], ATTRIBUTE_SIZES[b'vt'])
+    vn = ConcatenateBlocks(blocks[b'vn'], ATTRIBUTE_SIZES[b'vn'])
+    del blocks
+
+    for group in groups:
+        if group.corner_indices:
+            group.corner_indices = np.concatenate(group.corner_indices)
+        group.indices = None
+        group.corners = None
+
+    return v, vt, vn, groups
+
+
+def ParseAttributeBlock(block, keyword, size):
+    """
+    Parses a block of consecutive v/vt/vn records into an array.
+
+    Args:
+        block (bytes): Records of a single kind, separated by newlines.
+        keyword (bytes): Keyword of the records in the block.
+        size (int): Number of leading values to keep from every record.
+
+    Returns:
+        numpy.ndarray: Array of shape (records, size).
+    """
+    lines = block.count(b'\n') + 1
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            values = np.fromstring(block.translate(None, keyword), dtype=np.float64, sep=' ')
+        if values.size % lines or values.size // lines < size:
+            raise ValueError('uneven number of values per record')
+        return values.reshape(lines, -1)[:, :size]
+
+    # Records with differing lengths, parse them one by one
+    except (ValueError, DeprecationWarning):
+        return np.array([line.split()[1:size+1] for line in block.splitlines()], dtype=np.float64)
+
+
+def ParseFaceBlock(block):
+    """
+    Parses a block of consecutive face records.
+
+    Args:
+        block (bytes): Face records separated by newlines.
+
+    Returns:
+        tuple: (N, 3) array of v/vt/vn indices of every face corner, array of corner counts of every face.
+    """
+    # Count corners of every face by the slashes within its line
+    data = np.frombuffer(block, dtype=np.uint8)
+    line_starts = np.flatnonzero(data == ord('\n')) + 1
+    line_starts = np.insert(line_starts, 0, 0)
+    sizes = np.add.reduceat(data == ord('/'), line_starts, dtype=np.intp) // 2
+    del data
+
+    try:
+        if b'//' in block:
+            raise ValueError('missing face corner index')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            corners = np.fromstring(block.translate(MMAP_FACE_TABLE, b'f'), dtype=np.intp, sep=' ')
+        if corners.size != sizes.sum() * 3:
+            raise ValueError('unexpected number of face corner indices')
+
+    # Unusual corners, parse them one by one
+    except (ValueError, DeprecationWarning):
+        corners = []
+        sizes = []
+        for line in block.splitlines():
+            values = line.split()[1:]
+            sizes.append(len(values))
+            for corner in values:
+                corners.extend(corner.split(b'/'))
+        corners = np.array(corners, dtype=np.intp)
+        sizes = np.array(sizes, dtype=np.intp)
+
+    return corners.reshape(-1, 3), sizes
+
+
+def ConcatenateBlocks(blocks, size):
+    """
+    Joins parsed attribute blocks into a single (N, size) float array.
+    """
+    if not blocks:
+        return np.empty((0, size), dtype=np.float64)
+    return np.concatenate(blocks)
@@ -11,28 +11,146 @@ NOT REQUIRED FOR MODULES
 '''
 
 # External Imports
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 import math
+import numpy as np
+
+# Number of values rendered at once by IterFormatArray
+FORMAT_CHUNK_SIZE = 65536
+
+#########################
+# Serialization
+#########################
+
+class Serializable:
+    '''
+    Base class for all objects exportable to xml.
+    - self.iterstring(): Yields the xml of the object in chunks,
+      so that it never has to be built in memory as a whole.
+    '''
+    def iterstring(self):
+        raise NotImplementedError('Mandatory method not implemented')
+
+    def tostring(self):
+        return ''.join(self.iterstring())
+
+    def write(self, fp):
+        '''
+        Writes the xml of the object into a file object, chunk by chunk.
+        '''
+        for chunk in self.iterstring():
+            fp.write(chunk)
+
+
+def IterFormatArray(data, precision=None, separator=', '):
+    '''
+    Renders a flat numeric array as separated text, in chunks of
+    FORMAT_CHUNK_SIZE values, without building the whole text at once.
+    With default arguments the chunks joined together match the str() of data as a list,
+    float32 values are written with the shortest digits that round-trip as float32.
+
+    Args:
+        data (numpy.ndarray): Flat numeric array.
+        precision (int, optional): Significant digits of floats. Defaults to None (shortest exact repr).
+        separator (str, optional): Separator between values. Defaults to ', '.
+
+    Yields:
+        str: Separated values of every chunk, and separators between them.
+    '''
+    value_format = repr
+    if precision is not None and data.dtype.kind == 'f':
+        value_format = f'%.{precision}g'.__mod__
+    elif data.dtype == np.float32:
+        # tolist() widens the values to python floats, the repr of which
+        # shows the float32 rounding error, "0.1" becomes "0.10000000149011612"
+        value_format = str
+
+    for chunk_start in range(0, len(data), FORMAT_CHUNK_SIZE):
+        if chunk_start:
+            yield separator
+        chunk = data[chunk_start : chunk_start + FORMAT_CHUNK_SIZE]
+        if value_format is not str:
+            chunk = chunk.tolist()
+        if value_format is repr and separator == ', ':
+            yield str(chunk)[1:-1]
+        else:
+            yield separator.join(map(value_format, chunk))
+
 
 #########################
 # Data arrays
 #########################
 
 @dataclass
-class DataSimple:
+class DataSimple(Serializable):
     '''
     Contains a simple data array exportable to an xml tag.
+    Data can be either a list or a flat numpy.ndarray.
+    If self.dtype is set, data gets stored in a flat numpy.ndarray of that type,
+    accessing it returns views into that buffer.
+    Numeric arrays are exported with self.precision significant digits, if set,
+    and their values are separated with self.separator.
+    Values derived from data can be cached with self._cached(), the cache is
+    cleared whenever data gets replaced or set through the container.
+    The repr lists the whole data, as numpy would abbreviate large arrays.
     '''
     data: 		list
     tag_name: 	str
+    dtype = None
+    precision = None
+    separator = ', '
 
-    def _tostring(self):
+    def __post_init__(self):
+        self._convert_buffer()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Set before @dataclass runs on the subclass, so it keeps this repr
+        cls.__repr__ = DataSimple.__repr__
+
+    def __repr__(self):
+        values = []
+        for data_field in fields(self):
+            value = getattr(self, data_field.name)
+            if isinstance(value, np.ndarray):
+                # Float32 values are listed as they are exported
+                if value.dtype == np.float32:
+                    value = value.astype(str).astype(np.float64)
+                value = value.tolist()
+            values.append(f'{data_field.name}={value!r}')
+        return f'{type(self).__qualname__}({", ".join(values)})'
+
+    def __setattr__(self, name, value):
+        if name == 'data':
+            self.__dict__.pop('_cache', None)
+        super().__setattr__(name, value)
+
+    def _cached(self, key, function):
+        cache = self.__dict__.setdefault('_cache', {})
+        if key not in cache:
+            cache[key] = function()
+        return cache[key]
+
+    def _convert_buffer(self):
+        if self.dtype is not None:
+            self.data = np.ascontiguousarray(self.data, dtype=self.dtype).reshape(-1)
+
+    def _iterstring(self):
         if len(self.data) == 0:
-            return ' '
-        return str(self.data)[1:-1].replace("'", "").replace('"', '')
-
-    def tostring(self):
-        return f'<{self.tag_name}>{self._tostring()}</{self.tag_name}>'
+            yield ' '
+            return
+        data = self.data
+        if isinstance(data, np.ndarray):
+            if data.dtype.kind in 'fiu':
+                yield from IterFormatArray(data.reshape(-1), self.precision, self.separator)
+                return
+            data = data.tolist()
+        yield str(data)[1:-1].replace("'", "").replace('"', '')
+
+    def iterstring(self):
+        yield f'<{self.tag_name}>'
+        yield from self._iterstring()
+        yield f'</{self.tag_name}>'
 
     def __iter__(self):
         for item in self.data:
@@ -42,6 +160,7 @@ class DataSimple:
         return self.data[i]
 
     def __setitem__(self, i, new_value):
+        self.__dict__.pop('_cache', None)
         self.data[i] = new_value
 
     def __len__(self):
@@ -53,18 +172,37 @@ class DataGrouped(DataSimple):
     '''
     Contains a data array that groups its members into self.size length subarrays.
     Raw data length has to be divisible by self.size
+    Stored as float32, subarrays are views into the flat buffer.
     '''
     size: int
+    dtype = np.float32
+
     def __post_init__(self):
+        self._convert_buffer()
         if len(self.data) % self.size:
             raise ValueError(f'length of data not divisible by {self.size}')
 
-    def tostring(self):
-        return f'<{self.tag_name}><size>{self.size}</size><type>FLOAT</type><stride>{self.size*4}</stride><floatArray>{self._tostring()}</floatArray></{self.tag_name}>'
+    def iterstring(self):
+        yield f'<{self.tag_name}><size>{self.size}</size><type>FLOAT</type><stride>{self.size*4}</stride><floatArray>'
+        yield from self._iterstring()
+        yield f'</floatArray></{self.tag_name}>'
+
+    def grouped(self):
+        '''
+        Returns the data as a (len(self), self.size) view
+        '''
+        return self.data.reshape(-1, self.size)
+
+    def bounds(self):
+        '''
+        Returns the per-component minimum and maximum as lists, cached
+        '''
+        return self._cached('bounds', lambda: (self.grouped().min(axis=0).tolist(),
+                                               self.grouped().max(axis=0).tolist()))
 
     def __iter__(self):
-        for index in range(len(self.data)//self.size):
-            yield self.data[index*self.size : index*self.size + self.size]
+        for group in self.grouped():
+            yield group
 
     def __len__(self):
         return len(self.data)//self.size
@@ -118,24 +256,24 @@ class DataFixed(DataSimple):
 #########################
 
 @dataclass
-class EntryArray:
+class EntryArray(Serializable):
     '''
-    Container for list of objects with tostring() method. 
-    Cascade-tostrings itself and its members.
+    Container for list of Serializable objects.
+    Cascade-serializes itself and its members.
     '''
     entry_list: list
     tag_name:   str
 
-    def _tostring(self):
-        entry_list_str = ''
+    def _iterstring(self):
+        if not self.entry_list:
+            yield ' '
         for entry in self.entry_list:
-            entry_list_str += entry.tostring()
-        if not entry_list_str:
-            return ' '
-        return entry_list_str
+            yield from entry.iterstring()
 
-    def tostring(self):
-        return f'<{self.tag_name}>{self._tostring()}</{self.tag_name}>'
+    def iterstring(self):
+        yield f'<{self.tag_name}>'
+        yield from self._iterstring()
+        yield f'</{self.tag_name}>'
 
     def __iter__(self):
         for entry in self.entry_list:
@@ -300,7 +438,8 @@ class Exportable:
     '''
     Base class for all objects exportable with ExportXML
     - self.template_file: Points to the template file that should be used by ExportXML
-    - self.toargs(): Returns a dict compatible with self.template_file
+    - self.toargs(): Returns a dict compatible with self.template_file,
+      values can be either strings or Serializable objects
     '''
     template_file: str
 
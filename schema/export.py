@@ -12,9 +12,14 @@ NOT REQUIRED FOR MODULES
 
 # External Imports
 from dataclasses import dataclass
+import numpy as np
 
 # Internal Imports
-from schema.model import PrimitiveWrapper, Model
+from schema.model import Model, SkinnedPrimitive, BoneWeights
+from schema.base import IterFormatArray
+
+# Number of values rendered per array to estimate the savings of a number format
+FORMAT_SAMPLE_SIZE = 4096
 
 
 ######################
@@ -30,15 +35,16 @@ class StaticModel(Model):
 class ArticulatedModel(Model):
     mode: str = 'Articulated'
 
-    def _get_armature_str(self):
+    def _get_armature(self):
         if self.armature:
-            return self.armature.tostring()
+            return self.armature
         return '<root><name>%ROOT%</name><transform> </transform><children> </children></root>'
 
 
 def SetModelType(model: Model, mode: str):
     '''
     Sets the model type based on the given mode.
+    The primitive wrapper of the model is reused with its extents, only its tag gets changed.
 
     Args:
         model (Model): The model object to set the type for.
@@ -50,11 +56,65 @@ def SetModelType(model: Model, mode: str):
     Raises:
         Exception: If an unknown model mode is provided.
     '''
+    primitives = model.primitives
     if mode.capitalize() == 'Articulated':
-        return ArticulatedModel(primitives=PrimitiveWrapper(tag_name='skin', visible=model.primitives.visible),
-                                materials=model.materials, armature=model.armature)
+        primitives.tag_name = 'skin'
+        return ArticulatedModel(primitives=primitives, materials=model.materials, armature=model.armature)
     elif mode.capitalize() == 'Static':
-        return StaticModel(primitives=PrimitiveWrapper(tag_name='meshes', visible=model.primitives.visible),
-                           materials=model.materials, armature=model.armature)
+        primitives.tag_name = 'meshes'
+        return StaticModel(primitives=primitives, materials=model.materials, armature=model.armature)
     else:
         raise Exception('Unknown model mode.')
+
+
+def SetModelFormat(model: Model, positions=None, normals=None, texcoords=None, weights=None, compact=False):
+    '''
+    Sets the number format of the model data arrays.
+
+    Args:
+        model (Model): The model object to set the format for.
+        positions (int, optional): Significant digits of vertex positions. Defaults to None (exact).
+        normals (int, optional): Significant digits of normals. Defaults to None (exact).
+        texcoords (int, optional): Significant digits of texcoords. Defaults to None (exact).
+        weights (int, optional): Significant digits of bone weights. Defaults to None (exact).
+        compact (bool, optional): Separate values with "," instead of ", ". Defaults to False.
+
+    Returns:
+        int: Estimated number of bytes saved by the format in the data arrays.
+    '''
+    containers = []
+    for primitive in model.primitives:
+        containers.append((primitive.vertices, positions))
+        containers.append((primitive.normals, normals))
+        containers.extend((texcoord, texcoords) for texcoord in primitive.texcoords)
+        containers.append((primitive.indices, None))
+        if type(primitive) is SkinnedPrimitive:
+            containers.extend((attrib, weights if type(attrib) is BoneWeights else None)
+                              for attrib in primitive.vertex_attribs)
+
+    # Only the reformatted arrays count towards the savings
+    containers = [(container, precision) for container, precision in containers
+                  if precision is not None or compact]
+    separator = ',' if compact else ', '
+
+    saved = 0
+    for container, precision in containers:
+        data = np.asarray(container.data).reshape(-1)
+        saved += FormatSizeEstimate(data, container.precision, container.separator)
+        container.precision = precision
+        container.separator = separator
+        saved -= FormatSizeEstimate(data, precision, separator)
+    return round(saved)
+
+
+def FormatSizeEstimate(data, precision, separator):
+    '''
+    Estimates the length of a flat array rendered by IterFormatArray,
+    rendering only an evenly spread sample of FORMAT_SAMPLE_SIZE values,
+    so that the arrays are not formatted again before being written.
+    '''
+    if len(data) == 0:
+        return 0
+    sample = data[::max(1, len(data) // FORMAT_SAMPLE_SIZE)]
+    sample_size = sum(map(len, IterFormatArray(sample, precision, separator)))
+    return (sample_size + len(separator)) * len(data) / len(sample) - len(separator)
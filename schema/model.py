@@ -11,9 +11,10 @@ Schema for constructing Models.
 # External Imports
 from dataclasses import dataclass, field
 import math
+import numpy as np
 
 # Internal Imports
-from schema.base import DataSimple, DataGrouped, EntryArray, Transform, Exportable, Translation, Rotation, Scale, Matrix
+from schema.base import DataSimple, DataGrouped, EntryArray, Transform, Exportable, Serializable, Translation, Rotation, Scale, Matrix
 
 #######################
 # Ungrouped model data
@@ -37,6 +38,13 @@ class Indices(DataSimple):
     '''
     data: list[int]
     tag_name: str = 'indices'
+    dtype = np.uint32
+
+    def end(self):
+        '''
+        Returns the highest index, cached
+        '''
+        return self._cached('end', lambda: int(np.max(self.data)))
 
 
 #######################
@@ -89,8 +97,10 @@ class VertexAttribData(DataGrouped):
     Base class for special vertex bone data tags.
     '''
     name: str
-    def tostring(self):
-        return f'<{self.tag_name}><size>{self.size}</size><stride>{self.size*4}</stride><type>FLOAT</type><floatArray>{self._tostring()}</floatArray><name>{self.name}</name></{self.tag_name}>'
+    def iterstring(self):
+        yield f'<{self.tag_name}><size>{self.size}</size><stride>{self.size*4}</stride><type>FLOAT</type><floatArray>'
+        yield from self._iterstring()
+        yield f'</floatArray><name>{self.name}</name></{self.tag_name}>'
 
 
 @dataclass
@@ -132,11 +142,11 @@ class VertexAttribArray(EntryArray):
 # Armature Tree
 ######################
 @dataclass
-class ArmatureNode:
+class ArmatureNode(Serializable):
     '''
     Singular node of armature. If parent is None, automatically sets _tag_name to "root".
     Automatically attaches itself to parent object.
-    Calling self.tostring() cascade-tostrings current node and its children.
+    Serializing the node cascade-serializes its children.
     '''
     transform: Transform
     name: str
@@ -162,8 +172,11 @@ class ArmatureNode:
         for child in self._children.entry_list:
             child.parent = self
 
-    def tostring(self):
-        return f'<{self._tag_name}><name>{self.name}</name>{self.transform.tostring()}{self._children.tostring()}</{self._tag_name}>'
+    def iterstring(self):
+        yield f'<{self._tag_name}><name>{self.name}</name>'
+        yield from self.transform.iterstring()
+        yield from self._children.iterstring()
+        yield f'</{self._tag_name}>'
 
 
 ######################
@@ -171,7 +184,7 @@ class ArmatureNode:
 ######################
 
 @dataclass(kw_only=True)
-class Primitive:
+class Primitive(Serializable):
     '''
     Non-skinned geometry primitive. Features automatic min/max extent calculation.
     - self.tag and self.texture: Point to the material this primitive uses. (Both have to match)
@@ -179,6 +192,9 @@ class Primitive:
     
     Other attribs are self-explanatory.
 
+    The index range, trimmed data and extents are cached on the data containers,
+    so primitives rebuilt from the same containers do not recompute them.
+
     Can be converted to SkinnedPrimitive with PrimitiveAddSkin method.
     NOTE: Primitives use a single, shared set of indices for Vertices, Normals, Texcoords and VertexAttribs
     '''
@@ -203,30 +219,35 @@ class Primitive:
             raise ValueError(f'incorrect mode value: {self.mode}')
 
     def _trim_unnecessary_data(self):
-        self.vertices.data = self.vertices[0:self.indices_end+1]
-        self.normals.data = self.vertices[0:self.indices_end+1]
-        for i, texcoord in enumerate(self.texcoords):
-            self.texcoords[i].data = texcoord[0:self.indices_end+1]
+        # Already trimmed data is left as is, keeping its cache
+        for container in [self.vertices, self.normals, *self.texcoords]:
+            if len(container) > self.indices_end+1:
+                container.data = container[0:self.indices_end+1]
 
     def _calculate_indices_end(self):
-        self.indices_end = max(self.indices)
+        self.indices_end = self.indices.end()
 
     def _calculate_extents(self):
         vertex_size=3
         min_extent = [math.inf]*vertex_size
         max_extent = [-math.inf]*vertex_size
 
-        # Iterate through vertices to find min/max
-        for vertex in self.vertices:
-            for index, point in enumerate(vertex):
-                min_extent[index] = min(min_extent[index], point)
-                max_extent[index] = max(max_extent[index], point)
+        # Reduce all vertices at once to find min/max
+        if len(self.vertices):
+            min_extent, max_extent = self.vertices.bounds()
 
-        self.min_extent = DataSimple(min_extent, 'minExtent')
-        self.max_extent = DataSimple(max_extent, 'maxExtent')
+        # Kept as float32, as exported with the vertices
+        self.min_extent = DataSimple(np.array(min_extent, dtype=np.float32), 'minExtent')
+        self.max_extent = DataSimple(np.array(max_extent, dtype=np.float32), 'maxExtent')
 
-    def tostring(self):
-        return f'''<entry><texture>{self.texture}</texture><tag>{self.tag}</tag><geometry class="{self.geom_class}"><bounds>{self.min_extent.tostring()}{self.max_extent.tostring()}</bounds><mode>{self.mode}</mode>{self.texcoords.tostring()}{self.normals.tostring()}{self.vertices.tostring()}<end>{self.indices_end}</end>{self.indices.tostring()}</geometry></entry>'''
+    def iterstring(self):
+        yield f'<entry><texture>{self.texture}</texture><tag>{self.tag}</tag><geometry class="{self.geom_class}"><bounds>{self.min_extent.tostring()}{self.max_extent.tostring()}</bounds><mode>{self.mode}</mode>'
+        yield from self.texcoords.iterstring()
+        yield from self.normals.iterstring()
+        yield from self.vertices.iterstring()
+        yield f'<end>{self.indices_end}</end>'
+        yield from self.indices.iterstring()
+        yield '</geometry></entry>'
 
 
 @dataclass(kw_only=True)
@@ -244,13 +265,22 @@ class SkinnedPrimitive(Primitive):
     vertex_attribs: VertexAttribArray
     geom_class: str = 'com.threerings.opengl.geometry.config.GeometryConfig$SkinnedIndexedStored'
 
-    def tostring(self):
-        return f'''<entry><texture>{self.texture}</texture><tag>{self.tag}</tag><geometry class="{self.geom_class}"><bounds>{self.min_extent.tostring()}{self.max_extent.tostring()}</bounds><mode>{self.mode}</mode>{self.vertex_attribs.tostring()}{self.texcoords.tostring()}{self.normals.tostring()}{self.vertices.tostring()}<end>{self.indices_end}</end>{self.indices.tostring()}{self.bones.tostring()}</geometry></entry>'''
+    def iterstring(self):
+        yield f'<entry><texture>{self.texture}</texture><tag>{self.tag}</tag><geometry class="{self.geom_class}"><bounds>{self.min_extent.tostring()}{self.max_extent.tostring()}</bounds><mode>{self.mode}</mode>'
+        yield from self.vertex_attribs.iterstring()
+        yield from self.texcoords.iterstring()
+        yield from self.normals.iterstring()
+        yield from self.vertices.iterstring()
+        yield f'<end>{self.indices_end}</end>'
+        yield from self.indices.iterstring()
+        yield from self.bones.iterstring()
+        yield '</geometry></entry>'
 
 
 def PrimitiveAddSkin(primitive: Primitive, bones: Bones, vertex_attribs: VertexAttribArray):
     '''
     Adds skinning information to a primitive and returns a SkinnedPrimitive object.
+    Shares the data containers of the primitive, along with their cached values.
 
     Args:
         primitive (Primitive): The original primitive object.
@@ -273,7 +303,7 @@ def PrimitiveAddSkin(primitive: Primitive, bones: Bones, vertex_attribs: VertexA
     )
 
 @dataclass
-class PrimitiveWrapper:
+class PrimitiveWrapper(Serializable):
     '''
     Container for Primitive and SkinnedPrimitive objects. 
     Can check whether any of its members is a skinned primitive. 
@@ -288,17 +318,10 @@ class PrimitiveWrapper:
         self.visible = self._visible.entry_list	 # link by reference
 
     def _calculate_extents(self):
-        vertex_size = 3
-
-        max_extent = [-math.inf]*vertex_size
-        for i in range(vertex_size):
-            max_extent[i] = max(prim.max_extent[i] for prim in self.visible)
-        self.max_extent = DataSimple(max_extent, 'maxExtent')
-
-        min_extent = [math.inf]*vertex_size
-        for i in range(vertex_size):
-            min_extent[i] = min(prim.min_extent[i] for prim in self.visible)
-        self.min_extent = DataSimple(min_extent, 'minExtent')
+        # Reduce the extents of all primitives at once
+        extents = np.array([[prim.min_extent.data, prim.max_extent.data] for prim in self.visible], dtype=np.float32)
+        self.max_extent = DataSimple(extents[:, 1].max(axis=0), 'maxExtent')
+        self.min_extent = DataSimple(extents[:, 0].min(axis=0), 'minExtent')
 
     def isskinned(self):
         '''
@@ -306,8 +329,10 @@ class PrimitiveWrapper:
         '''
         return any(type(primitive) is SkinnedPrimitive for primitive in self.visible)
 
-    def tostring(self):
-        return f'<{self.tag_name}><bounds>{self.min_extent.tostring()}{self.max_extent.tostring()}</bounds>{self._visible.tostring()}</{self.tag_name}>'
+    def iterstring(self):
+        yield f'<{self.tag_name}><bounds>{self.min_extent.tostring()}{self.max_extent.tostring()}</bounds>'
+        yield from self._visible.iterstring()
+        yield f'</{self.tag_name}>'
 
     def __iter__(self):
         for entry in self.visible:
@@ -328,7 +353,7 @@ class PrimitiveWrapper:
 ######################
 
 @dataclass
-class Material:
+class Material(Serializable):
     '''
     Basic material information.
     - self.tag and self.texture: If both match the same pair of tags in any primitive, this material will be applied to it.
@@ -337,8 +362,8 @@ class Material:
     tag:		str
     name: str = 'Model/Opaque'
 
-    def tostring(self):
-        return f'<entry><outer rdepth="1"/><key class="java.lang.String">Pass Mode</key><value class="java.lang.String">Normal</value><texture>{self.texture}</texture><tag>{self.tag}</tag><material><name>{self.name}</name><arguments><key class="java.lang.String">Texture</key><value class="com.threerings.config.ConfigReference"><name>2D/File/Default</name><arguments><key class="java.lang.String">File</key><value class="java.lang.String">PressToSelectTextureFile.png</value><key class="java.lang.String">Magnify</key><value class="com.threerings.opengl.renderer.config.TextureConfig$MagFilter">LINEAR</value><key class="java.lang.String">Minify</key><value class="com.threerings.opengl.renderer.config.TextureConfig$MinFilter">LINEAR</value></arguments></value></arguments></material></entry>'
+    def iterstring(self):
+        yield f'<entry><outer rdepth="1"/><key class="java.lang.String">Pass Mode</key><value class="java.lang.String">Normal</value><texture>{self.texture}</texture><tag>{self.tag}</tag><material><name>{self.name}</name><arguments><key class="java.lang.String">Texture</key><value class="com.threerings.config.ConfigReference"><name>2D/File/Default</name><arguments><key class="java.lang.String">File</key><value class="java.lang.String">PressToSelectTextureFile.png</value><key class="java.lang.String">Magnify</key><value class="com.threerings.opengl.renderer.config.TextureConfig$MagFilter">LINEAR</value><key class="java.lang.String">Minify</key><value class="com.threerings.opengl.renderer.config.TextureConfig$MinFilter">LINEAR</value></arguments></value></arguments></material></entry>'
 
 
 def MaterialAddSkin(material: Material):
@@ -390,15 +415,15 @@ class Model(Exportable):
             for i, material in enumerate(self.materials):
                 self.materials[i] = MaterialAddSkin(material)
 
-    def _get_armature_str(self):
+    def _get_armature(self):
         if self.armature:
-            return self.armature.tostring()
+            return self.armature
         return ' '
 
     def toargs(self):
         args = {}
-        args['primitives'] = self.primitives.tostring()
-        args['materials'] = self.materials.tostring()
-        args['armature'] = self._get_armature_str()
+        args['primitives'] = self.primitives
+        args['materials'] = self.materials
+        args['armature'] = self._get_armature()
         args['mode'] = self.mode
         return args
\ No newline at end of file
@@ -0,0 +1,43 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+# Square grid of size x size quads in the xy plane, as obj text
+def GridObj(size, indent=''):
+    lines = []
+    for y in range(size + 1):
+        for x in range(size + 1):
+            lines.append(f'{indent}v {x/size} {y/size} 0.1')
+            lines.append(f'{indent}vt {x/size} {y/size}')
+    lines.append(f'{indent}vn 0 0 1')
+    for y in range(size):
+        for x in range(size):
+            a = y*(size + 1) + x + 1
+            b, c, d = a + 1, a + size + 2, a + size + 1
+            lines.append(f'{indent}f {a}/{a}/1 {b}/{b}/1 {c}/{c}/1 {d}/{d}/1')
+    return '\n'.join(lines) + '\n'
+
+
+@pytest.fixture
+def grid_obj():
+    return GridObj
+
+
+# Runs the test within a temporary directory holding the templates
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    shutil.copytree(os.path.join(REPO_DIR, 'templates'), tmp_path / 'templates')
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,40 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import os
+import subprocess
+import sys
+
+from conftest import REPO_DIR
+
+
+def test_no_file_prints_whole_data(tmp_path, grid_obj):
+    # Over a thousand values, numpy abbreviates larger arrays
+    file_name = tmp_path / 'grid.obj'
+    file_name.write_text(grid_obj(40))
+
+    output = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'cli.py'),
+                             '--no-file', '--skip-update', str(file_name)],
+                            cwd=tmp_path, capture_output=True, text=True, check=True).stdout
+
+    assert '...' not in output
+    vertices = output.split("Vertices(data=[")[1].split(']')[0].split(', ')
+    assert len(vertices) == 41*41*3
+    assert vertices[:6] == ['0.0', '0.0', '0.1', '0.025', '0.0', '0.1']
+    assert not list(tmp_path.glob('*.xml'))
+
+
+def test_negative_precision_rejected(tmp_path, grid_obj):
+    file_name = tmp_path / 'grid.obj'
+    file_name.write_text(grid_obj(2))
+
+    process = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'cli.py'),
+                              '--skip-update', '--precision-positions', '-1', str(file_name)],
+                             cwd=tmp_path, capture_output=True, text=True)
+
+    assert process.returncode == 2
+    assert '--precision-positions' in process.stderr
+    assert not list(tmp_path.glob('*.xml'))
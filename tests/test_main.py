@@ -0,0 +1,56 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import multiprocessing
+import os
+import types
+
+import pytest
+
+import modules
+from main import Main, Settings
+
+
+# Worker processes see the patched modules only when forked
+requires_fork = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                   reason='workers do not inherit patched modules')
+
+
+@requires_fork
+def test_parallel_worker_crash(workdir, monkeypatch, grid_obj):
+    def Extract(file_name):
+        os._exit(1)
+    plugin = types.SimpleNamespace(Extract=Extract, module_data={'Name': 'Crash'})
+    monkeypatch.setitem(modules.__modules__, 'crash', plugin)
+
+    file_names = []
+    for name in ('a.obj', 'b.crash', 'c.obj', 'd.obj'):
+        (workdir / name).write_text(grid_obj(2))
+        file_names.append(str(workdir / name))
+
+    with pytest.raises(Exception, match='Failed to convert 1 of 4 files.'):
+        Main(Settings(file_names=file_names, jobs=2))
+    assert sorted(path.name for path in workdir.glob('*.xml')) == ['a.xml', 'c.xml', 'd.xml']
+
+
+@pytest.mark.parametrize('overwrite', [False, True])
+def test_parallel_same_output_names(workdir, grid_obj, overwrite):
+    file_names = []
+    for directory in ('a', 'b'):
+        (workdir / directory).mkdir()
+        (workdir / directory / 'x.obj').write_text(grid_obj(2))
+        file_names.append(str(workdir / directory / 'x.obj'))
+
+    output_dir = workdir / 'out'
+    Main(Settings(file_names=file_names, jobs=2, output_dir=str(output_dir), overwrite_output=overwrite))
+    assert sorted(path.name for path in output_dir.iterdir()) == ['x(1).xml', 'x.xml']
+
+
+def test_settings_reject_precision():
+    for precision in (0, -1):
+        with pytest.raises(ValueError):
+            Settings(file_names=[], precision_normals=precision)
+    assert Settings(file_names=[], precision_normals=1).precision_normals == 1
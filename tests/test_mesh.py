@@ -0,0 +1,27 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import numpy as np
+import pytest
+
+from components.mesh import DeduplicateCorners, TriangulatePolygons
+
+
+# Packed keys for non-negative indices, rows otherwise
+@pytest.mark.parametrize('offset', [0, -5])
+def test_deduplicate_corners(offset):
+    corners = np.array([[3, 1, 0], [0, 2, 1], [3, 1, 0], [1, 1, 1], [0, 2, 1], [3, 1, 2]]) + offset
+    unique, indices = DeduplicateCorners(corners)
+
+    assert unique.tolist() == (np.array([[3, 1, 0], [0, 2, 1], [1, 1, 1], [3, 1, 2]]) + offset).tolist()
+    assert indices.tolist() == [0, 1, 0, 2, 1, 3]
+    assert (unique[indices] == corners).all()
+
+
+# Polygons with less than 3 corners are dropped
+def test_triangulate_polygons():
+    triangles = TriangulatePolygons([4, 2, 3, 5])
+    assert triangles.tolist() == [[0, 1, 2], [0, 2, 3], [6, 7, 8], [9, 10, 11], [9, 11, 12], [9, 12, 13]]
@@ -0,0 +1,38 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import types
+
+import modules
+from components.module_import import ProcessModules, ProcessModulesIter
+
+
+def test_single_argument_extract(monkeypatch):
+    calls = []
+    def Extract(file_name):
+        calls.append(file_name)
+        return ['model']
+
+    plugin = types.SimpleNamespace(Extract=Extract, module_data={'Name': 'Plugin'})
+    monkeypatch.setitem(modules.__modules__, 'plugin', plugin)
+
+    Extract, module_data = ProcessModules('model.plugin')
+    assert Extract('model.plugin', object()) == ['model']
+    IterExtract, module_data = ProcessModulesIter('model.plugin')
+    assert list(IterExtract('model.plugin', object())) == ['model']
+    assert calls == ['model.plugin', 'model.plugin']
+
+
+def test_settings_passed_to_extract(monkeypatch):
+    settings = object()
+    def Extract(file_name, settings=None):
+        return [settings]
+
+    plugin = types.SimpleNamespace(Extract=Extract, module_data={'Name': 'Plugin'})
+    monkeypatch.setitem(modules.__modules__, 'plugin', plugin)
+
+    Extract, module_data = ProcessModules('model.plugin')
+    assert Extract('model.plugin', settings) == [settings]
@@ -0,0 +1,44 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import modules.obj as obj
+
+
+# Converts the file with both readers, the streamed one and the memory mapped one
+def ExtractBoth(monkeypatch, file_name):
+    streamed = obj.Extract(str(file_name))
+    monkeypatch.setattr(obj, 'MMAP_THRESHOLD', -1)
+    mapped = obj.Extract(str(file_name))
+    return streamed, mapped
+
+
+def test_unnamed_groups(tmp_path, monkeypatch, grid_obj):
+    lines = grid_obj(2).splitlines()
+    faces = lines.index('f 1/1/1 2/2/1 5/5/1 4/4/1')
+    lines[faces:faces] = ['g body', 'usemtl skin.png', 'g', 'usemtl', 'o  ']
+    lines.insert(faces + 7, 'g  other   part')
+    file_name = tmp_path / 'groups.obj'
+    file_name.write_text('\n'.join(lines) + '\n')
+
+    streamed, mapped = ExtractBoth(monkeypatch, file_name)
+    assert repr(streamed) == repr(mapped)
+
+    primitives = streamed[0].primitives.visible
+    assert [primitive.texture for primitive in primitives] == ['skin.png', 'skin.png']
+    assert len(primitives[0].indices) == 8 and len(primitives[1].indices) == 8
+
+
+def test_indented_records(tmp_path, monkeypatch, grid_obj):
+    plain = tmp_path / 'plain.obj'
+    plain.write_text(grid_obj(3))
+    expected = repr(obj.Extract(str(plain)))
+
+    for indent in ('  ', '\t', ' \t'):
+        file_name = tmp_path / 'indented.obj'
+        file_name.write_text(grid_obj(3, indent).replace(f'{indent}f 1/', 'g part\n\tf 1/'))
+        streamed, mapped = ExtractBoth(monkeypatch, file_name)
+        monkeypatch.undo()
+        assert repr(streamed) == repr(mapped) == expected
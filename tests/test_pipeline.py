@@ -0,0 +1,22 @@
+###############################################################
+# by Crowfunder                                               #
+# Copyright my ass but also the GPL-3.0 License               #
+# Github: https://github.com/Crowfunder                       #
+###############################################################
+
+import pytest
+
+from components.pipeline import ReadAhead
+
+
+# Missing files are left for the modules, other errors stop the prefetching
+def test_read_ahead_error(tmp_path):
+    file_name = str(tmp_path / 'model.obj')
+    missing = str(tmp_path / 'missing.obj')
+    open(file_name, 'w').close()
+
+    file_names = ReadAhead([file_name, missing, None, file_name], 2)
+    assert next(file_names) == file_name
+    assert next(file_names) == missing
+    with pytest.raises(TypeError):
+        next(file_names)